@@ -1,41 +1,90 @@
 import abc
-import copy
+import heapq
+import queue
+import random
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
 from enum import Enum
 from functools import total_ordering
-from typing import List
+from itertools import repeat
+from math import dist, exp, inf, log
+from multiprocessing import shared_memory
+from typing import Callable, Iterator, List
 
-from Colour import ColoursList
-from Utils import Time, Assert
+import numpy as np
+
+from Bound import LowerBound
+from Colour import ColoursList, ColourGrid, Metric
+from Utils import Time, Assert, Instrumentation
 
 
 class AlgorithmType(Enum):
     GREEDY_CONSTRUCTIVE = 0,
     HILL_CLIMBING = 1,
     MULTI_START_HC = 2,
-    DELTA_SORT = 3
+    DELTA_SORT = 3,
+    LOCAL_SEARCH = 4,
+    SIMULATED_ANNEALING = 5,
+    ITERATED_LOCAL_SEARCH = 6,
+    SPACE_FILLING_CURVE = 7,
+    DIVIDE_AND_CONQUER = 8,
+    GENETIC_ALGORITHM = 9
+
+
+class StartingSolution(Enum):
+    """The ordering an improvement algorithm starts from."""
+    LOADED = 0,
+    GREEDY = 1,
+    RANDOM = 2,
+    CURVE = 3  # the Hilbert curve order, which scales to palettes too large for the greedy ordering
 
 
 @total_ordering
 class AlgorithmSolution(object):
     """
-    The solution found by the algorithm.
+    The solution found by the algorithm, stored as a permutation of the indexes of a palette.
+    The palette is shared by all the solutions of an algorithm, so each solution only takes O(N) int32,
+    and the ordered colours are only built when they are requested.
+    The total distance is measured with the metric of the palette, which the solution records.
     """
-    colours: ColoursList
+    palette: ColoursList
+    order: np.ndarray
     total_distance: float
+    metric: Metric
 
-    def __init__(self, colours: ColoursList, total_distance: float = None):
-        self.colours = colours
-        self.total_distance = colours.get_total_distance() if total_distance is None else total_distance
+    def __init__(self, palette: ColoursList, total_distance: float = None, order=None):
+        """
+        :param palette: the colours the order refers to.
+        :param total_distance: the total distance of the ordered colours with the metric of the palette.
+        If None, it is computed.
+        :param order: the indexes of the palette colours in the order of the solution.
+        If None, the solution is the palette in its own order.
+        """
+        self.palette = palette
+        self.order = np.arange(len(palette), dtype=np.int32) if order is None else np.array(order, dtype=np.int32)
+        self.metric = palette.metric
+        self.total_distance = palette.get_path_distance(self.order) if total_distance is None else total_distance
 
     def __eq__(self, other: 'AlgorithmSolution'):
-        return self.get_colours() == other.get_colours() and \
+        return np.array_equal(self.get_order(), other.get_order()) and \
                self.get_total_distance() == other.get_total_distance()
 
+    def __len__(self):
+        return len(self.order)
+
     def __lt__(self, other: 'AlgorithmSolution'):
         return self.get_total_distance() < other.get_total_distance()
 
-    def get_colours(self):
-        return self.colours
+    def get_colours(self) -> ColoursList:
+        return self.palette.permute(self.order)
+
+    def get_metric(self) -> Metric:
+        return self.metric
+
+    def get_order(self) -> np.ndarray:
+        return self.order
 
     def get_total_distance(self):
         return self.total_distance
@@ -43,14 +92,22 @@ class AlgorithmSolution(object):
 
 class Algorithm(metaclass=abc.ABCMeta):
     colours: ColoursList
-    solutions: List[AlgorithmSolution]
+    trace: List[tuple]
 
     HILL_CLIMBING_ITERATIONS = 500
+    MAX_SOLUTIONS = 10
 
     def __init__(self, *args):
         self.colours = ColoursList()
-        self.solutions = []
         self.iterations = 0
+        self.current_iteration = 0
+
+        # Only the best MAX_SOLUTIONS solutions are kept, in a heap of (-distance, count, solution) entries whose
+        # root is the worst of them. The distance of every saved solution is recorded in the convergence trace.
+        self.max_solutions = self.MAX_SOLUTIONS
+        self.__solutions = []
+        self.__saved_solutions = 0
+        self.trace = []  # (iteration, total distance) of every saved solution
 
         # Debug
         self.debug = False
@@ -61,6 +118,26 @@ class Algorithm(metaclass=abc.ABCMeta):
         self.run_time = 0
         self.total_distance = 0
 
+        # Instrumentation: counters are only recorded when enabled, and the profiler is an
+        # optional context manager (e.g. a CProfileHook) entered around find_solutions
+        self.instrumentation = Instrumentation()
+        self.profiler = None
+
+        # Optional ConvergenceLog, entered around find_solutions, to which every saved solution is appended
+        self.convergence_log = None
+
+        # Early termination: with a target gap, the lower bound of the loaded colours is computed when the algorithm
+        # runs, and it stops as soon as the gap between its best solution and the bound is within the target
+        self.target_gap = None
+        self.lower_bound = None
+        self.__gap_reached = False
+
+        # Anytime solving
+        self.__best_solution = None
+        self.__deadline = None
+        self.__cancelled = False
+        self.__on_improvement = None
+
     @staticmethod
     def factory(algorithm_type: AlgorithmType, *args) -> 'Algorithm':
         """Define factory method for algorithms."""
@@ -68,16 +145,58 @@ class Algorithm(metaclass=abc.ABCMeta):
 
         if algorithm_type == AlgorithmType.GREEDY_CONSTRUCTIVE:
             return GreedyConstructive(
-                distance_method=args[0] if len(args) > 0 else GreedyConstructive.DistanceMethod.EUCLIDEAN)
+                distance_method=args[0] if len(args) > 0 else GreedyConstructive.DistanceMethod.EUCLIDEAN,
+                starts=args[1] if len(args) > 1 else 1,
+                seed=args[2] if len(args) > 2 else None)
 
         if algorithm_type == AlgorithmType.HILL_CLIMBING:
-            return HillClimbing()
+            return HillClimbing(
+                seed=args[0] if len(args) > 0 else None,
+                strategy=args[1] if len(args) > 1 else HillClimbing.Strategy.RANDOM)
 
         if algorithm_type == AlgorithmType.MULTI_START_HC:
-            return MultiStartHillClimbing()
+            return MultiStartHillClimbing(
+                workers=args[0] if len(args) > 0 else 1,
+                seed=args[1] if len(args) > 1 else None)
 
         if algorithm_type == AlgorithmType.DELTA_SORT:
-            return DeltaSort()
+            return DeltaSort(seed=args[0] if len(args) > 0 else None)
+
+        if algorithm_type == AlgorithmType.LOCAL_SEARCH:
+            return LocalSearch(
+                neighbours=args[0] if len(args) > 0 else LocalSearch.NEIGHBOURS,
+                seed=args[1] if len(args) > 1 else None)
+
+        if algorithm_type == AlgorithmType.SIMULATED_ANNEALING:
+            return SimulatedAnnealing(
+                cooling_schedule=args[0] if len(args) > 0 else SimulatedAnnealing.CoolingSchedule.GEOMETRIC,
+                starting_solution=args[1] if len(args) > 1 else StartingSolution.GREEDY,
+                seed=args[2] if len(args) > 2 else None)
+
+        if algorithm_type == AlgorithmType.ITERATED_LOCAL_SEARCH:
+            return IteratedLocalSearch(
+                starting_solution=args[0] if len(args) > 0 else StartingSolution.GREEDY,
+                seed=args[1] if len(args) > 1 else None)
+
+        if algorithm_type == AlgorithmType.SPACE_FILLING_CURVE:
+            return SpaceFillingCurve(
+                curve=args[0] if len(args) > 0 else SpaceFillingCurve.Curve.HILBERT,
+                window=args[1] if len(args) > 1 else 0)
+
+        if algorithm_type == AlgorithmType.DIVIDE_AND_CONQUER:
+            return DivideAndConquer(
+                cluster_size=args[0] if len(args) > 0 else DivideAndConquer.CLUSTER_SIZE,
+                cluster_algorithm=args[1] if len(args) > 1 else AlgorithmType.HILL_CLIMBING,
+                workers=args[2] if len(args) > 2 else 1,
+                seed=args[3] if len(args) > 3 else None)
+
+        if algorithm_type == AlgorithmType.GENETIC_ALGORITHM:
+            return GeneticAlgorithm(
+                crossover=args[0] if len(args) > 0 else GeneticAlgorithm.Crossover.ORDER,
+                population_size=args[1] if len(args) > 1 else GeneticAlgorithm.POPULATION_SIZE,
+                generations=args[2] if len(args) > 2 else GeneticAlgorithm.GENERATIONS,
+                workers=args[3] if len(args) > 3 else 1,
+                seed=args[4] if len(args) > 4 else None)
 
     @abc.abstractmethod
     def find_solution(self, *args):
@@ -87,39 +206,197 @@ class Algorithm(metaclass=abc.ABCMeta):
         return self.__class__.__name__
 
     def get_solutions(self) -> List[AlgorithmSolution]:
-        Assert.not_empty(self.solutions, "No solutions have been found yet.")
-        sorted(self.solutions)
-        return self.solutions
+        """Get the best solutions found, from the best to the worst."""
+        Assert.not_empty(self.__solutions, "No solutions have been found yet.")
+        return [solution for _, _, solution in sorted(self.__solutions, reverse=True)]
+
+    def get_trace(self) -> List[tuple]:
+        """Get the (iteration, total distance) pairs of every saved solution, in the order they were found."""
+        Assert.not_empty(self.trace, "No solutions have been found yet.")
+        return self.trace
 
-    def get_best_solution(self):
-        return self.get_solutions()[-1]
+    def get_best_solution(self) -> AlgorithmSolution:
+        """Get the best solution found so far. This can be called while the algorithm is running."""
+        Assert.not_none(self.__best_solution, "No solutions have been found yet.")
+        return self.__best_solution
 
-    def get_run_time(self):
+    def get_gap(self) -> float:
+        """Get the gap between the best solution and the lower bound of the loaded colours, relative to the bound."""
+        Assert.not_none(self.lower_bound, "The lower bound has not been computed.")
+        return LowerBound.get_gap(self.get_best_solution().get_total_distance(), self.lower_bound)
+
+    def cancel(self):
+        """Ask the running algorithm to stop as soon as possible."""
+        self.__cancelled = True
+
+    def is_stopped(self) -> bool:
+        """Check whether the algorithm has been cancelled, has run out of time or has reached the target gap."""
+        return self.__cancelled or self.__gap_reached or \
+            (self.__deadline is not None and Time.get_monotonic_seconds() >= self.__deadline)
+
+    def get_starting_order(self, starting_solution: StartingSolution, generator: random.Random) -> List[int]:
+        """
+        Get the indexes of the loaded colours in the order an improvement algorithm should start from.
+        :param starting_solution: which ordering to start from.
+        :param generator: the random generator used for the random ordering and the start of the greedy tour.
+        """
+        if starting_solution == StartingSolution.GREEDY:
+            greedy = GreedyConstructive(seed=generator.getrandbits(64))
+            greedy.colours = self.colours
+            with Instrumentation.phase("starting_solution"):
+                return greedy.find_order()
+
+        if starting_solution == StartingSolution.CURVE:
+            curve = SpaceFillingCurve()
+            curve.colours = self.colours
+            with Instrumentation.phase("starting_solution"):
+                return curve.find_order().tolist()
+
+        order = list(range(len(self.colours)))
+        if starting_solution == StartingSolution.RANDOM:
+            generator.shuffle(order)
+        return order
+
+    @property
+    def metric(self) -> Metric:
+        """The metric the algorithm minimises the total distance with, which is the metric of the loaded colours."""
+        return self.colours.metric
+
+    @metric.setter
+    def metric(self, metric: Metric):
+        self.colours.metric = metric
+        self.reset()
+
+    def get_run_time(self) -> float:
         """
         Get the running time by subtracting end time from start time.
-        :return: the algorithm running time in microseconds.
+        :return: the algorithm running time in seconds, measured with nanosecond resolution.
         """
-        seconds = Time.millis_to_seconds(self.__end_time, self.__start_time)
-        return float("{0:.2f}".format(seconds))
+        return Time.nanos_to_seconds(self.__end_time, self.__start_time)
+
+    def reseed(self, seed: int):
+        """
+        Reset the random generator of the algorithm, so that its next runs only depend on the seed.
+        Algorithms with other random state override this to derive all of it from the seed.
+        """
+        self.random = random.Random(seed)
 
     def load_colours_list(self, colours_list: ColoursList):
+        """Load a copy of the colours, measured with the metric of the algorithm."""
+        metric = self.metric
         self.colours = colours_list.clone()
+        self.colours.metric = metric
+        self.reset()
 
-    def run(self, iterations: int):
-        self.iterations = iterations
-        self.__start_time = Time.get_timestamp_millis()
-        for _ in range(self.iterations):
+    def reset(self):
+        """
+        Forget the state derived from the loaded colours, such as the lower bound and cached distances, which is
+        called whenever the colours or their metric change. Algorithms with such state override this to clear it.
+        """
+        self.lower_bound = None
+
+    def find_solutions(self, iterations: int = None):
+        """
+        Call find_solution the given number of times, or until the algorithm is stopped if iterations is None.
+        Algorithms whose iterations are independent can override this to run them in parallel.
+        """
+        self.current_iteration = 0
+        while (iterations is None or self.current_iteration < iterations) and not self.is_stopped():
             self.find_solution()
-        self.__end_time = Time.get_timestamp_millis()
-        self.run_time = self.get_run_time()
+            self.current_iteration += 1
+
+    def run(self, iterations: int = None, time_limit: float = None,
+            on_improvement: Callable[[AlgorithmSolution], None] = None):
+        """
+        Run the algorithm.
+        :param iterations: the number of times to call find_solution. If None, the algorithm runs until
+        the time limit expires or it is cancelled.
+        :param time_limit: the wall-clock budget in seconds.
+        :param on_improvement: called with every solution better than all the ones found before it.
+        The run also stops as soon as the best solution is within target_gap of the lower bound, if it is set.
+        """
+        assert iterations is not None or time_limit is not None, "Either iterations or time_limit must be set."
+        self.iterations = iterations
+        self.__cancelled = False
+        self.__gap_reached = False
+        self.__on_improvement = on_improvement
+        self.__start_time = Time.get_timestamp_nanos()
+        self.__deadline = None if time_limit is None else Time.get_monotonic_seconds() + time_limit
+        try:
+            with self.instrumentation.activate(), \
+                    self.profiler if self.profiler is not None else nullcontext(), \
+                    self.convergence_log if self.convergence_log is not None else nullcontext():
+                if self.target_gap is not None and self.lower_bound is None:
+                    with Instrumentation.phase("lower_bound"):
+                        self.lower_bound = LowerBound.get_lower_bound(
+                            self.colours, None if self.__best_solution is None else
+                            self.__best_solution.get_total_distance())
+                self.__update_gap_reached()
+                self.find_solutions(self.iterations)
+        finally:
+            self.__deadline = None
+            self.__on_improvement = None
+            self.__end_time = Time.get_timestamp_nanos()
+            self.run_time = self.get_run_time()
+
+    def solve(self, iterations: int = None, time_limit: float = None) -> Iterator[AlgorithmSolution]:
+        """
+        Run the algorithm in a background thread, yielding each improved solution as soon as it is found.
+        Closing the generator cancels the run.
+        :param iterations: the number of times to call find_solution.
+        :param time_limit: the wall-clock budget in seconds.
+        """
+        improvements = queue.Queue()
+        finished = object()
+        errors = []
+
+        def run():
+            try:
+                self.run(iterations, time_limit, improvements.put)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                improvements.put(finished)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            solution = improvements.get()
+            while solution is not finished:
+                yield solution
+                solution = improvements.get()
+        finally:
+            self.cancel()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    def __update_gap_reached(self):
+        if self.target_gap is not None and self.lower_bound is not None and self.__best_solution is not None:
+            self.__gap_reached = self.get_gap() <= self.target_gap
 
     def save_solution(self, solution: ColoursList or AlgorithmSolution):
         if type(solution) is ColoursList:
-            self.solutions.append(AlgorithmSolution(solution))
-        elif type(solution) is AlgorithmSolution:
-            self.solutions.append(solution)
-        else:
-            assert "Trying to save wrong type of solution."
+            solution = AlgorithmSolution(solution)
+        elif type(solution) is not AlgorithmSolution:
+            assert False, "Trying to save wrong type of solution."
+        self.trace.append((self.current_iteration, solution.get_total_distance()))
+        if self.convergence_log is not None:
+            self.convergence_log.append(self.current_iteration, solution.get_total_distance(), solution.get_order())
+
+        entry = (-solution.get_total_distance(), self.__saved_solutions, solution)
+        self.__saved_solutions += 1
+        if len(self.__solutions) < self.max_solutions:
+            heapq.heappush(self.__solutions, entry)
+        elif entry > self.__solutions[0]:
+            heapq.heapreplace(self.__solutions, entry)
+
+        if self.__best_solution is None or solution < self.__best_solution:
+            self.__best_solution = solution
+            self.__update_gap_reached()
+            if self.__on_improvement is not None:
+                self.__on_improvement(solution)
 
 
 class GreedyConstructive(Algorithm):
@@ -127,59 +404,170 @@ class GreedyConstructive(Algorithm):
         EUCLIDEAN = 0,
         DELTA_E = 1
 
-    def __init__(self, distance_method: DistanceMethod = DistanceMethod.EUCLIDEAN):
+    ALL_STARTS = 0
+    MAX_BLOCK_ELEMENTS = 2 ** 22  # the maximum number of distances of the batched tours held in memory at once
+    MAX_DENSE_ELEMENTS = 2 ** 25  # the size of the largest distance matrix expanded from the condensed layout
+
+    def __init__(self, distance_method: DistanceMethod = DistanceMethod.EUCLIDEAN, starts: int = 1,
+                 seed: int = None):
+        """
+        :param distance_method: the distance the nearest colours are found with.
+        :param starts: the number of random colours the tours of each iteration start from, or ALL_STARTS to
+        start a tour from every colour. With more than one start, the tours are built together and all of them
+        are saved, so the distances of the solutions give their distribution.
+        :param seed: the seed of the random generator that picks the starting colours.
+        If None, it is drawn from the global random generator.
+        """
         super(GreedyConstructive, self).__init__()
         self.distance_method = distance_method
+        self.starts = starts
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
 
-    def find_solution(self):
-        colours = copy.deepcopy(self.colours)
-        solution = ColoursList()
+    def __find_euclidean_order(self) -> List[int]:
+        """
+        Build the nearest neighbour tour over the colour indexes using a spatial index of the coordinates of
+        the metric of the colours, removing each colour from the index as soon as it is visited.
+        """
+        values = self.colours.coordinates
+        grid = ColourGrid(values)
         # Get a random colour
-        current_colour = colours.pop_random()
-        solution.append(current_colour)
-        while len(colours) > 0:
+        current_index = self.random.randrange(len(self.colours))
+        grid.remove(current_index)
+        order = [current_index]
+        while len(grid) > 0:
             # Get the nearest colour to the current one
-            current_colour, _ = colours.get_nearest_colour_euclidean(current_colour) \
-                if self.distance_method == GreedyConstructive.DistanceMethod.EUCLIDEAN \
-                else colours.get_nearest_colour_delta_e(current_colour)
-            solution.append(current_colour)
-            del colours[current_colour]
+            current_index, _ = grid.nearest(values[current_index])
+            grid.remove(current_index)
+            order.append(current_index)
+        return order
+
+    def find_matrix_order(self, metric: Metric = None) -> List[int]:
+        """
+        Build the nearest neighbour tour over the colour indexes using the given metric, reading the distances
+        between the current colour and all the unvisited ones from the cached matrix. This is faster than the
+        spatial index for small palettes, whose matrix is cheap to compute.
+        :param metric: the distance, the metric of the colours by default.
+        """
+        matrix = self.colours.get_distance_matrix(metric)
+        remaining = np.arange(len(self.colours))
+        # Get a random colour
+        position = self.random.randrange(len(self.colours))
+        order = []
+        while len(remaining) > 0:
+            current_index = remaining[position]
+            order.append(int(current_index))
+            remaining = np.delete(remaining, position)
+            if len(remaining) > 0:
+                # Get the nearest colour to the current one
+                position = int(np.argmin(matrix.get_row(current_index, remaining)))
+        return order
+
+    def find_batch_orders(self, starts) -> np.ndarray:
+        """
+        Build the nearest neighbour tours from all the given colours at once over the cached distance matrix.
+        The tours advance in lockstep, one colour per step, by masking the colours each tour has visited in the
+        rows of the matrix of their current colours. Each tour is the one find_matrix_order builds from its start.
+        :param starts: the indexes of the colours the tours start from.
+        :return: an S x N int32 array with the indexes of the loaded colours in the order of every tour.
+        """
+        size = len(self.colours)
+        starts = np.asarray(starts, dtype=np.intp)
+        matrix = self.colours.get_distance_matrix(
+            Metric.CIEDE2000 if self.distance_method == GreedyConstructive.DistanceMethod.DELTA_E else None)
+        columns = np.arange(size)
+        dense = matrix.get_dense() if size * size <= self.MAX_DENSE_ELEMENTS else None
+
+        orders = np.empty((len(starts), size), dtype=np.int32)
+        block_size = max(1, self.MAX_BLOCK_ELEMENTS // max(1, size))
+        for first in range(0, len(starts), block_size):
+            current = starts[first:first + block_size]
+            tours = np.arange(len(current))
+            visited = np.zeros((len(current), size), dtype=bool)
+            visited[tours, current] = True
+            orders[first:first + len(current), 0] = current
+            for step in range(1, size):
+                distances = dense[current] if dense is not None else matrix.get_block(current, columns)
+                distances[visited] = inf
+                current = np.argmin(distances, axis=1)
+                visited[tours, current] = True
+                orders[first:first + len(current), step] = current
+        return orders
+
+    def find_order(self) -> List[int]:
+        """
+        Build a nearest neighbour tour from a random colour and return the indexes of the loaded colours.
+        The EUCLIDEAN distance method follows the metric of the colours, while DELTA_E always uses CIEDE2000.
+        """
+        if self.distance_method == GreedyConstructive.DistanceMethod.DELTA_E:
+            return self.find_matrix_order(Metric.CIEDE2000)
+        if not self.colours.metric.is_euclidean():
+            return self.find_matrix_order()
+        return self.__find_euclidean_order()
 
-        self.solutions.append(AlgorithmSolution(solution, solution.get_total_distance()))
+    def find_solution(self):
+        if self.starts == 1:
+            self.save_solution(AlgorithmSolution(self.colours, order=self.find_order()))
+            return
+
+        size = len(self.colours)
+        starts = range(size) if self.starts == self.ALL_STARTS or self.starts >= size \
+            else self.random.sample(range(size), self.starts)
+        with Instrumentation.phase("batched_tours"):
+            orders = self.find_batch_orders(starts)
+        for order, distance in zip(orders, self.colours.get_path_distances(orders)):
+            self.save_solution(AlgorithmSolution(self.colours, float(distance), order))
 
 
 class HillClimbing(Algorithm):
-    temp_solution: ColoursList
+    """
+    Improve the loaded colours with reversals of ranges of colours (2-opt moves), either picked at random or
+    chosen among all the possible reversals, which are scored together with array operations.
+    """
+    best_solution: ColoursList
+    best_order: np.ndarray
+
+    class Strategy(Enum):
+        RANDOM = 0,  # evaluate random reversals one at a time
+        FIRST_IMPROVEMENT = 1,  # apply the best reversal of the first chunk of rows that improves the solution
+        BEST_IMPROVEMENT = 2  # apply the best of all the reversals
 
-    def __init__(self):
+    BLOCK_ELEMENTS = 2 ** 22  # the maximum number of reversals scored at once
+    FIRST_IMPROVEMENT_ROWS = 16  # the number of rows of reversals scored at once by the first improvement strategy
+    EPSILON = 1e-12
+
+    def __init__(self, seed: int = None, strategy: Strategy = Strategy.RANDOM):
+        """
+        :param seed: the seed of the random generator used to pick the moves.
+        If None, it is drawn from the global random generator.
+        :param strategy: how the reversals are chosen.
+        """
         super(HillClimbing, self).__init__()
         self.is_initialized = False
-        self.best_solution = self.temp_solution = None
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
+        self.strategy = strategy
+        self.best_solution = None
         self.best_solution_distance = None
+        self.best_order = None  # the indexes of the loaded colours in the order of the best solution
+        self.__path_distances = None
 
-    @staticmethod
-    def __invert_range(colours_list: ColoursList, start, end):
-        colours_list.colours[start:end] = colours_list[start:end][::-1]
+    def reset(self):
+        super(HillClimbing, self).reset()
+        self.is_initialized = False
+        self.best_solution = None
+        self.best_solution_distance = None
+        self.best_order = None
+        self.__path_distances = None
 
     @staticmethod
     def __swap_colours(colours: ColoursList, index1, index2):
         colours[index1], colours[index2] = colours[index2], colours[index1]
 
-    @staticmethod
-    def __get_random_indexes(colours: ColoursList) -> (int, int):
+    def __get_random_indexes(self, colours: ColoursList) -> (int, int):
         """
-        Get two random indexes from self.temp_solution ensuring that index1 < index2.
+        Get two different random indexes from the list ensuring that index1 < index2.
         :return: int index1, int index2
         """
-        colour1 = colours.get_random_element()
-        colour2 = colours.get_random_element()
-
-        # Ensure that the elements are different
-        while colour1 == colour2:
-            colour2 = colours.get_random_element()
-
-        index1 = colours.get_index(colour1)
-        index2 = colours.get_index(colour2)
+        index1, index2 = self.random.sample(range(len(colours)), 2)
 
         # Swap indexes if index1 > index2
         if index1 > index2:
@@ -190,47 +578,1280 @@ class HillClimbing(Algorithm):
     def __get_random_permutation(self):
         return self.colours.random_permutation(len(self.colours))
 
-    def find_solution(self):
-        # TODO Check if all clone calls are necessary.
-        for _ in range(self.HILL_CLIMBING_ITERATIONS):
-            if self.is_initialized is False:
-                self.best_solution = self.temp_solution = self.colours.clone()
-                self.best_solution_distance = self.best_solution.get_total_distance()
-                self.save_solution(self.best_solution)
-                self.is_initialized = True
+    def __reverse(self, index1: int, index2: int, delta: float):
+        """Reverse the colours of the best solution between the two indexes (both included) and save it."""
+        temp_solution_distance = self.best_solution_distance + delta
+        if self.debug:
+            print(f"Previous distance: {self.best_solution_distance} - New distance: {temp_solution_distance}")
+        self.best_solution.reverse_range(index1, index2 + 1)
+        self.best_order[index1:index2 + 1] = self.best_order[index1:index2 + 1][::-1]
+        if self.__path_distances is not None:
+            # The colour at index i is at position i + 1 of the path
+            self.__path_distances[index1 + 1:index2 + 2] = self.__path_distances[index1 + 1:index2 + 2][::-1].copy()
+            self.__path_distances[:, index1 + 1:index2 + 2] = \
+                self.__path_distances[:, index1 + 1:index2 + 2][:, ::-1].copy()
+        self.best_solution_distance = temp_solution_distance
+        self.save_solution(AlgorithmSolution(self.colours, temp_solution_distance, self.best_order))
 
+    def __climb_random(self):
+        proposed = accepted = 0
+        for _ in range(self.HILL_CLIMBING_ITERATIONS):
+            if self.is_stopped():
+                break
+            proposed += 1
+            # Evaluate the reversal of the colours between the two indexes (both included)
+            # without touching the list; it is only applied if it improves the solution.
             index1, index2 = self.__get_random_indexes(self.best_solution)
-            self.__invert_range(self.temp_solution, index1, index2)
-            temp_solution_distance = self.temp_solution.get_total_distance()
-
-            if self.temp_solution.get_total_distance() < self.best_solution_distance:
-                if self.debug:
-                    print(f"Previous distance: {self.best_solution_distance} - New distance: {temp_solution_distance}")
-                self.best_solution = self.temp_solution.clone()
-                self.best_solution_distance = temp_solution_distance
-                self.save_solution(self.best_solution)
-            else:
-                # Not improving; go back to previous state
-                self.temp_solution = self.best_solution.clone()
+            delta = self.best_solution.get_reverse_range_delta(index1, index2 + 1)
+
+            if delta < 0:
+                self.__reverse(index1, index2, delta)
+                accepted += 1
+
+        # Each move is evaluated from the four distances of the edges it replaces and creates,
+        # which the CIEDE2000 kernel counts itself
+        if self.colours.metric.is_euclidean():
+            Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, 4 * proposed)
+        Instrumentation.count(Instrumentation.MOVES_PROPOSED, proposed)
+        Instrumentation.count(Instrumentation.MOVES_ACCEPTED, accepted)
+        Instrumentation.count(Instrumentation.MOVES_REJECTED, proposed - accepted)
+
+    def __get_path_distances(self) -> np.ndarray:
+        """
+        Get the distance matrix of the colours in the order of the best solution, with an extra dummy colour
+        at both ends at zero distance from all the others, so that the end colours can be moved like any other.
+        The matrix is then kept in the order of the path by reversing its rows and columns with every move.
+        It holds (N + 2) x (N + 2) float64 distances for the whole climb, so unlike the scoring of the reversals its
+        memory is not bounded by BLOCK_ELEMENTS: the vectorised strategies are meant for palettes of a few thousand
+        colours at most.
+        """
+        size = len(self.colours)
+        matrix = self.colours.get_distance_matrix()
+        distances = np.zeros((size + 2, size + 2), dtype=np.float64)
+        block_size = max(1, self.BLOCK_ELEMENTS // size)
+        for start in range(0, size, block_size):
+            rows = self.best_order[start:start + block_size]
+            distances[start + 1:start + 1 + len(rows), 1:-1] = matrix.get_block(rows, self.best_order)
+        return distances
+
+    def find_reversal(self, first_improvement: bool = False, excluded: set = None) -> (float, int, int, int):
+        """
+        Score every reversal of the best solution in blocks of rows and get the best one.
+        In the best order padded with the dummy colour at both ends, reversing the positions a + 1 to b replaces
+        the edges (a, a + 1) and (b, b + 1) with (a, b) and (a + 1, b + 1), so the change in distance of all the
+        reversals is a sum of four slices of the distance matrix kept in the order of the path.
+        :param first_improvement: whether to score the rows in chunks of FIRST_IMPROVEMENT_ROWS and stop at the
+        first chunk that contains an improving reversal.
+        :param excluded: the (first, last) indexes of the colours of reversals that are not scored.
+        :return: the change in total distance of the best reversal, the indexes of its first and last colours,
+        and the number of reversals scored.
+        """
+        distances = self.__path_distances
+        edges = np.diagonal(distances, 1)
+        size = len(edges)
+        columns = np.arange(size)
+        block_size = max(1, self.BLOCK_ELEMENTS // size)
+        if first_improvement:
+            block_size = min(block_size, self.FIRST_IMPROVEMENT_ROWS)
+
+        best_delta, best_start, best_end = 0.0, 0, 0
+        scored = 0
+        for start in range(0, size - 1, block_size):
+            end = min(start + block_size, size - 1)
+            rows = columns[start:end]
+            deltas = distances[start:end, :-1] + distances[start + 1:end + 1, 1:] - edges[start:end, np.newaxis] - edges
+            deltas[columns <= rows[:, np.newaxis]] = inf
+            for index1, index2 in excluded or ():
+                if start <= index1 < end:
+                    deltas[index1 - start, index2 + 1] = inf
+            scored += int(np.sum(size - 1 - rows))
+
+            best = int(np.argmin(deltas))
+            if deltas.flat[best] < best_delta:
+                best_delta, best_start, best_end = float(deltas.flat[best]), int(rows[best // size]), best % size
+            if first_improvement and best_delta < -self.EPSILON:
+                break
+        return best_delta, best_start, best_end - 1, scored
+
+    def __climb_vectorised(self):
+        if self.__path_distances is None:
+            with Instrumentation.phase("distance_matrix"):
+                self.__path_distances = self.__get_path_distances()
+
+        first_improvement = self.strategy == HillClimbing.Strategy.FIRST_IMPROVEMENT
+        proposed = accepted = 0
+        # The reversals that only improve the solution because of the rounding of the float32 distances, which
+        # are skipped until the next move changes the solution
+        rounding_errors = set()
+        for _ in range(self.HILL_CLIMBING_ITERATIONS):
+            if self.is_stopped():
+                break
+            delta, index1, index2, scored = self.find_reversal(first_improvement, rounding_errors)
+            proposed += scored
+            if delta >= -self.EPSILON:
+                # 2-opt local optimum
+                break
+            # The matrix holds float32 distances, so the move is applied with its exact change in distance
+            delta = self.best_solution.get_reverse_range_delta(index1, index2 + 1)
+            if delta >= -self.EPSILON:
+                rounding_errors.add((index1, index2))
+                continue
+            self.__reverse(index1, index2, delta)
+            rounding_errors.clear()
+            accepted += 1
+
+        Instrumentation.count(Instrumentation.MOVES_PROPOSED, proposed)
+        Instrumentation.count(Instrumentation.MOVES_ACCEPTED, accepted)
+        Instrumentation.count(Instrumentation.MOVES_REJECTED, proposed - accepted)
+
+    def find_solution(self):
+        if self.is_initialized is False:
+            self.best_solution = self.colours.clone()
+            self.best_solution_distance = self.best_solution.get_total_distance()
+            self.best_order = np.arange(len(self.best_solution), dtype=np.int32)
+            self.save_solution(AlgorithmSolution(self.colours, self.best_solution_distance, self.best_order))
+            self.is_initialized = True
+
+        if len(self.best_solution) < 2:
+            return
+
+        if self.strategy == HillClimbing.Strategy.RANDOM:
+            self.__climb_random()
+        else:
+            self.__climb_vectorised()
 
 
 class MultiStartHillClimbing(Algorithm):
-    def __init__(self):
+    """
+    Run independent hill climbing restarts from the loaded colours and keep the best solution of each.
+    With more than one worker, the restarts are spread across processes that read the colour
+    coordinates from a single block of shared memory and only send back the best permutation.
+    """
+    QUEUED_RESTARTS = 2  # the number of restarts submitted ahead for each worker
+
+    def __init__(self, workers: int = 1, seed: int = None):
+        """
+        :param workers: the number of worker processes used to run the restarts.
+        :param seed: the seed from which the random generator of every restart is derived.
+        If None, it is drawn from the global random generator.
+        """
         super(MultiStartHillClimbing, self).__init__()
+        self.workers = workers
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.restarts = 0
 
-    def find_solution(self):
-        algorithm = Algorithm.factory(AlgorithmType.HILL_CLIMBING)
-        algorithm.load_colours_list(self.colours)
+    @staticmethod
+    def run_restart(colours: ColoursList, seed: int) -> (np.ndarray, float):
+        """
+        Run a single hill climbing restart on the colours.
+        :return: the best permutation of the colours indexes and its total distance.
+        """
+        algorithm = HillClimbing(seed)
+        algorithm.colours = colours
         algorithm.find_solution()
-        self.save_solution(algorithm.get_best_solution())
+        return algorithm.best_order, algorithm.best_solution_distance
+
+    @staticmethod
+    def run_shared_restart(memory_name: str, size: int, seed: int, instrumented: bool = False,
+                           metric: Metric = Metric.EUCLIDEAN) -> (np.ndarray, float, dict):
+        """
+        Run a single restart on the colour coordinates stored in the named shared memory block.
+        :param metric: the metric of the colours.
+        :return: the best permutation, its total distance and the instrumentation counters of the restart.
+        """
+        memory = shared_memory.SharedMemory(name=memory_name)
+        instrumentation = Instrumentation(instrumented)
+        try:
+            values = np.ndarray((size, 3), dtype=np.float64, buffer=memory.buf)
+            with instrumentation.activate():
+                order, distance = MultiStartHillClimbing.run_restart(ColoursList(values, metric=metric), seed)
+            # Release the views on the buffer before closing it
+            del values
+            return order, distance, instrumentation.counters
+        finally:
+            memory.close()
+
+    def __get_restart_seed(self, restart: int) -> int:
+        """Get the seed of the given restart, independent from the order in which restarts run."""
+        return int(np.random.SeedSequence(self.seed, spawn_key=(restart,)).generate_state(1, np.uint64)[0])
+
+    def __next_seeds(self, count: int) -> List[int]:
+        seeds = [self.__get_restart_seed(restart) for restart in range(self.restarts, self.restarts + count)]
+        self.restarts += count
+        return seeds
+
+    def __save_restart(self, order: np.ndarray, distance: float):
+        self.save_solution(AlgorithmSolution(self.colours, distance, order))
+
+    def reseed(self, seed: int):
+        self.seed = seed
+        self.restarts = 0
+
+    def find_solution(self):
+        seed, = self.__next_seeds(1)
+        self.__save_restart(*self.run_restart(self.colours, seed))
+
+    def find_solutions(self, iterations: int = None):
+        if self.workers <= 1 or (iterations is not None and iterations <= 1):
+            super(MultiStartHillClimbing, self).find_solutions(iterations)
+            return
+
+        values = self.colours.values
+        memory = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+        try:
+            shared_values = np.ndarray(values.shape, dtype=np.float64, buffer=memory.buf)
+            shared_values[:] = values
+            del shared_values
+
+            # Keep a queue of restarts ahead of the workers and save each one as soon as it completes, so that a
+            # slow restart only holds up its own worker, and the time limit, cancellation and target gap are
+            # checked after every restart
+            self.current_iteration = 0
+            submitted = 0
+            pending = set()
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    while len(pending) < self.QUEUED_RESTARTS * self.workers and \
+                            (iterations is None or submitted < iterations) and not self.is_stopped():
+                        seed, = self.__next_seeds(1)
+                        pending.add(executor.submit(MultiStartHillClimbing.run_shared_restart, memory.name,
+                                                    len(values), seed, self.instrumentation.enabled, self.metric))
+                        submitted += 1
+                    if not pending:
+                        break
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        order, distance, counters = future.result()
+                        self.instrumentation.merge(counters)
+                        self.__save_restart(order, distance)
+                        self.current_iteration += 1
+                    if self.is_stopped():
+                        # The restarts that have not started are dropped, the running ones are waited for
+                        for future in pending:
+                            future.cancel()
+                        break
+        finally:
+            memory.close()
+            memory.unlink()
 
 
 class DeltaSort(Algorithm):
-    def __init__(self):
+    def __init__(self, seed: int = None):
+        """
+        :param seed: the seed of the random generator that picks the starting colour of every tour.
+        If None, it is drawn from the global random generator.
+        """
         super(DeltaSort, self).__init__()
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
 
     def find_solution(self):
-        algorithm = Algorithm.factory(AlgorithmType.GREEDY_CONSTRUCTIVE, GreedyConstructive.DistanceMethod.DELTA_E)
-        algorithm.load_colours_list(self.colours)
-        algorithm.find_solution()
-        self.save_solution(algorithm.get_best_solution())
+        algorithm = Algorithm.factory(AlgorithmType.GREEDY_CONSTRUCTIVE, GreedyConstructive.DistanceMethod.DELTA_E,
+                                      1, self.random.getrandbits(64))
+        algorithm.colours = self.colours
+        self.save_solution(AlgorithmSolution(self.colours, order=algorithm.find_order()))
+
+
+class LocalSearch(Algorithm):
+    """
+    Local search with 2-opt, Or-opt and 3-opt moves restricted to the nearest neighbours of each colour.
+    Only moves that make a colour adjacent to one of its neighbours are evaluated. A colour whose moves
+    do not improve the solution gets its don't-look bit set and is only visited again when one of its
+    edges changes, so each run stops as soon as it reaches a local optimum.
+    """
+    NEIGHBOURS = 8
+    OR_OPT_SEGMENT_LENGTH = 3
+    EPSILON = 1e-12
+
+    def __init__(self, neighbours: int = NEIGHBOURS, seed: int = None):
+        """
+        :param neighbours: the number of nearest neighbours considered for each colour.
+        :param seed: the seed of the random generator that orders the initial colours queue.
+        If None, it is drawn from the global random generator.
+        """
+        super(LocalSearch, self).__init__()
+        self.neighbours = neighbours
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
+        self.__candidates = None
+        self.__points = None  # the coordinates of the colours, for euclidean metrics
+        self.__matrix = None  # the distance matrix of the colours, for the other metrics
+        self.__order = []
+        self.__position = []
+        self.__queue = deque()
+        self.__in_queue = []
+
+    def reset(self):
+        super(LocalSearch, self).reset()
+        self.__candidates = None
+        self.__points = None
+        self.__matrix = None
+
+    # PRIVATE METHODS
+
+    def __at(self, position: int):
+        """Get the colour at the given position, or None if the position is outside the path."""
+        return self.__order[position] if 0 <= position < len(self.__order) else None
+
+    def __distance(self, colour1, colour2) -> float:
+        if colour1 is None or colour2 is None:
+            return 0.0
+        if self.__matrix is not None:
+            return self.__matrix.get(colour1, colour2)
+        return dist(self.__points[colour1], self.__points[colour2])
+
+    def __activate(self, *colours):
+        """Clear the don't-look bit of the colours."""
+        for colour in colours:
+            if colour is not None and not self.__in_queue[colour]:
+                self.__in_queue[colour] = True
+                self.__queue.append(colour)
+
+    def __set_order(self, start: int, end: int, colours: list):
+        """Replace the colours between the two positions (both included) and update their positions."""
+        self.__order[start:end + 1] = colours
+        for position in range(start, end + 1):
+            self.__position[self.__order[position]] = position
+
+    def __try_two_opt(self, colour) -> bool:
+        d, at = self.__distance, self.__at
+        i = self.__position[colour]
+        longest_edge = max(d(at(i - 1), colour), d(colour, at(i + 1)))
+        for candidate in self.__candidates[colour]:
+            if d(colour, candidate) >= longest_edge:
+                break
+            j = self.__position[candidate]
+            first, last = min(i, j), max(i, j)
+            if last - first < 2:
+                continue
+            # Both reversals make the colour adjacent to the candidate
+            for start, end in ((first + 1, last), (first, last - 1)):
+                delta = d(at(start - 1), at(end)) + d(at(start), at(end + 1)) - \
+                        d(at(start - 1), at(start)) - d(at(end), at(end + 1))
+                if delta < -self.EPSILON:
+                    self.__activate(at(start - 1), at(start), at(end), at(end + 1))
+                    self.__set_order(start, end, self.__order[start:end + 1][::-1])
+                    return True
+        return False
+
+    def __try_or_opt(self, colour) -> bool:
+        d, at = self.__distance, self.__at
+        i = self.__position[colour]
+        size = len(self.__order)
+        for length in range(1, self.OR_OPT_SEGMENT_LENGTH + 1):
+            for start, end in {(i, i + length - 1), (i - length + 1, i)}:
+                if start < 0 or end >= size:
+                    continue
+                previous, following = at(start - 1), at(end + 1)
+                other = self.__order[end] if self.__order[start] == colour else self.__order[start]
+                removal_gain = d(previous, self.__order[start]) + d(self.__order[end], following) - \
+                    d(previous, following)
+                if removal_gain <= self.EPSILON:
+                    continue
+
+                for candidate in self.__candidates[colour]:
+                    if d(colour, candidate) >= removal_gain:
+                        break
+                    j = self.__position[candidate]
+                    if start - 1 <= j <= end + 1:
+                        continue
+                    # Insert the segment after the candidate (colour first) or before it (colour last)
+                    for after in (True, False):
+                        neighbour = at(j + 1) if after else at(j - 1)
+                        if neighbour is not None and start <= self.__position[neighbour] <= end:
+                            continue
+                        insertion_cost = d(candidate, colour) + d(other, neighbour) - d(candidate, neighbour)
+                        if insertion_cost - removal_gain < -self.EPSILON:
+                            self.__activate(previous, following, colour, other, candidate, neighbour)
+                            self.__move_segment(start, end, j, after, colour)
+                            return True
+        return False
+
+    def __move_segment(self, start: int, end: int, target: int, after: bool, colour):
+        """
+        Move the segment between start and end next to the colour at the target position, oriented so
+        that the given colour is adjacent to it.
+        """
+        segment = self.__order[start:end + 1]
+        if (segment[0] == colour) != after:
+            segment.reverse()
+        if target > end:
+            # Shift the colours between the segment and the target back
+            insert_at = target + 1 if after else target
+            shifted = self.__order[end + 1:insert_at]
+            self.__set_order(start, insert_at - 1, shifted + segment)
+        else:
+            insert_at = target + 1 if after else target
+            shifted = self.__order[insert_at:start]
+            self.__set_order(insert_at, end, segment + shifted)
+
+    def __try_three_opt(self, colour) -> bool:
+        """Exchange the two segments that follow the colour, so that it becomes adjacent to a neighbour."""
+        d, at = self.__distance, self.__at
+        i = self.__position[colour]
+        following = at(i + 1)
+        if following is None:
+            return False
+        for candidate in self.__candidates[colour]:
+            gain = d(colour, following) - d(colour, candidate)
+            if gain <= self.EPSILON:
+                break
+            j = self.__position[candidate]
+            if j <= i + 1:
+                continue
+            before_candidate = at(j - 1)
+            for segment_end in self.__candidates[following]:
+                k = self.__position[segment_end]
+                if k < j:
+                    continue
+                after_segment = at(k + 1)
+                delta = d(segment_end, following) + d(before_candidate, after_segment) - \
+                    d(before_candidate, candidate) - d(segment_end, after_segment) - gain
+                if delta < -self.EPSILON:
+                    self.__activate(colour, following, before_candidate, candidate, segment_end, after_segment)
+                    self.__set_order(i + 1, k, self.__order[j:k + 1] + self.__order[i + 1:j])
+                    return True
+        return False
+
+    def __improve(self, colour) -> bool:
+        return self.__try_two_opt(colour) or self.__try_or_opt(colour) or self.__try_three_opt(colour)
+
+    # PUBLIC METHODS
+
+    def optimise(self, order: List[int], active: List[int] = None, is_stopped: Callable[[], bool] = None) -> List[int]:
+        """
+        Apply improving moves to the order of the loaded colours until it reaches a local optimum.
+        :param order: the indexes of the loaded colours in the starting order.
+        :param active: the colours whose don't-look bits start cleared. If None, all the colours are visited.
+        :param is_stopped: checked before every move, the search returns the current order as soon as it is True.
+        If None, the search stops with this algorithm, so an algorithm that runs it can pass its own is_stopped.
+        :return: the locally optimal order.
+        """
+        is_stopped = self.is_stopped if is_stopped is None else is_stopped
+        if self.__candidates is None:
+            with Instrumentation.phase("neighbour_lists"):
+                self.__candidates = self.colours.get_nearest_neighbours(self.neighbours).tolist()
+                if self.colours.metric.is_euclidean():
+                    self.__points = [tuple(point) for point in self.colours.coordinates.tolist()]
+                else:
+                    self.__matrix = self.colours.get_distance_matrix()
+
+        self.__order = list(order)
+        self.__position = [0] * len(self.__order)
+        for position, colour in enumerate(self.__order):
+            self.__position[colour] = position
+
+        initial = list(self.__order if active is None else active)
+        self.random.shuffle(initial)
+        self.__queue = deque()
+        self.__in_queue = [False] * len(self.__order)
+        self.__activate(*initial)
+
+        # A move is counted for each colour whose neighbourhood is searched; it is accepted if the
+        # search finds an improving move
+        proposed = accepted = 0
+        with Instrumentation.phase("local_search"):
+            while self.__queue and not is_stopped():
+                colour = self.__queue.popleft()
+                self.__in_queue[colour] = False
+                proposed += 1
+                if self.__improve(colour):
+                    self.__activate(colour)
+                    accepted += 1
+
+        Instrumentation.count(Instrumentation.MOVES_PROPOSED, proposed)
+        Instrumentation.count(Instrumentation.MOVES_ACCEPTED, accepted)
+        Instrumentation.count(Instrumentation.MOVES_REJECTED, proposed - accepted)
+        return list(self.__order)
+
+    def find_solution(self):
+        self.save_solution(AlgorithmSolution(self.colours, order=self.optimise(range(len(self.colours)))))
+
+
+class SimulatedAnnealing(Algorithm):
+    """
+    Simulated annealing over segment reversals that make a random colour adjacent to one of its nearest
+    neighbours. Each move is scored from the two edges it replaces, so a run costs a constant amount of
+    work per rejected move. Every call to find_solution performs a full annealing run and saves its best solution.
+    """
+
+    class CoolingSchedule(Enum):
+        GEOMETRIC = 0,
+        LINEAR = 1,
+        LOGARITHMIC = 2
+
+    MOVES = 200000
+    NEIGHBOURS = 8
+    TEMPERATURE_STEP = 100  # number of moves between temperature updates
+    FINAL_TEMPERATURE_RATIO = 1e-3
+    TEMPERATURE_SAMPLES = 200
+
+    def __init__(self, moves: int = MOVES, neighbours: int = NEIGHBOURS,
+                 cooling_schedule: CoolingSchedule = CoolingSchedule.GEOMETRIC,
+                 initial_temperature: float = None, final_temperature: float = None,
+                 starting_solution: StartingSolution = StartingSolution.GREEDY, seed: int = None):
+        """
+        :param moves: the number of moves of each annealing run.
+        :param neighbours: the number of nearest neighbours each colour can be moved next to.
+        :param cooling_schedule: how the temperature decreases from the initial to the final one.
+        :param initial_temperature: if None, it is estimated so that half of the average worsening moves
+        are accepted at the start.
+        :param final_temperature: if None, it is FINAL_TEMPERATURE_RATIO times the initial temperature.
+        :param starting_solution: the ordering each run starts from.
+        :param seed: the seed of the random generator. If None, it is drawn from the global random generator.
+        """
+        super(SimulatedAnnealing, self).__init__()
+        self.moves = moves
+        self.neighbours = neighbours
+        self.cooling_schedule = cooling_schedule
+        self.initial_temperature = initial_temperature
+        self.final_temperature = final_temperature
+        self.starting_solution = starting_solution
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
+        self.__points = None  # the coordinates of the colours, for euclidean metrics
+        self.__matrix = None  # the distance matrix of the colours, for the other metrics
+        self.__candidates = None
+
+    def reset(self):
+        super(SimulatedAnnealing, self).reset()
+        self.__points = None
+        self.__matrix = None
+        self.__candidates = None
+
+    def __get_move(self, order: List[int], position: List[int]) -> (int, int):
+        """
+        Get the first and last positions (both included) of a segment whose reversal makes a random
+        colour adjacent to one of its neighbours. The segment is empty (start > end) if they already are.
+        """
+        colour = order[self.random.randrange(len(order))]
+        candidate = self.random.choice(self.__candidates[colour])
+        first, last = sorted((position[colour], position[candidate]))
+        return (first + 1, last) if self.random.random() < 0.5 else (first, last - 1)
+
+    def __get_delta(self, order: List[int], start: int, end: int) -> float:
+        if self.__matrix is not None:
+            return self.__matrix.get_reverse_delta(order, start, end)
+        points = self.__points
+        delta = 0.0
+        if start > 0:
+            delta += dist(points[order[start - 1]], points[order[end]]) - \
+                     dist(points[order[start - 1]], points[order[start]])
+        if end < len(order) - 1:
+            delta += dist(points[order[start]], points[order[end + 1]]) - \
+                     dist(points[order[end]], points[order[end + 1]])
+        return delta
+
+    def __estimate_initial_temperature(self, order: List[int], position: List[int]) -> float:
+        moves = [self.__get_move(order, position) for _ in range(self.TEMPERATURE_SAMPLES)]
+        deltas = [self.__get_delta(order, start, end) for start, end in moves if start < end]
+        worsening = [delta for delta in deltas if delta > 0]
+        return (sum(worsening) / len(worsening)) / log(2) if worsening else 1.0
+
+    def get_temperature(self, progress: float, initial: float, final: float) -> float:
+        """
+        Get the temperature of the cooling schedule.
+        :param progress: the fraction of the moves already performed, between 0 and 1.
+        """
+        if self.cooling_schedule == SimulatedAnnealing.CoolingSchedule.LINEAR:
+            return initial + (final - initial) * progress
+        if self.cooling_schedule == SimulatedAnnealing.CoolingSchedule.LOGARITHMIC:
+            # T = T0 / (1 + c log(1 + k)), with c chosen so that the last move is at the final temperature
+            c = (initial / final - 1) / log(1 + self.moves)
+            return initial / (1 + c * log(1 + progress * self.moves))
+        return initial * (final / initial) ** progress
+
+    def anneal(self, order: List[int]) -> List[int]:
+        """
+        Run simulated annealing from the given order of the loaded colours. The starting order is saved, and then
+        the best order found whenever it has improved at the end of a temperature step, so that a solution is
+        available at any time.
+        :return: the best order found.
+        """
+        order = list(order)
+        self.save_solution(AlgorithmSolution(self.colours, order=order))
+        if len(order) < 3:
+            return order
+
+        position = [0] * len(order)
+        for index, colour in enumerate(order):
+            position[colour] = index
+
+        initial = self.initial_temperature if self.initial_temperature is not None \
+            else self.__estimate_initial_temperature(order, position)
+        final = self.final_temperature if self.final_temperature is not None \
+            else initial * self.FINAL_TEMPERATURE_RATIO
+        current_distance = best_distance = saved_distance = self.colours.get_path_distance(order)
+        best_order = list(order)
+        accept = self.random.random
+        temperature = initial
+        proposed = accepted = 0
+
+        for move in range(self.moves):
+            if move % self.TEMPERATURE_STEP == 0:
+                if best_distance < saved_distance:
+                    self.save_solution(AlgorithmSolution(self.colours, order=best_order))
+                    saved_distance = best_distance
+                if self.is_stopped():
+                    break
+                temperature = max(self.get_temperature(move / self.moves, initial, final), 1e-300)
+
+            start, end = self.__get_move(order, position)
+            if start >= end:
+                continue
+            proposed += 1
+            delta = self.__get_delta(order, start, end)
+            if delta < 0 or accept() < exp(-delta / temperature):
+                accepted += 1
+                order[start:end + 1] = order[start:end + 1][::-1]
+                for index in range(start, end + 1):
+                    position[order[index]] = index
+                current_distance += delta
+                if current_distance < best_distance:
+                    best_distance = current_distance
+                    best_order = list(order)
+
+        if best_distance < saved_distance:
+            self.save_solution(AlgorithmSolution(self.colours, order=best_order))
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, 4 * proposed)
+        Instrumentation.count(Instrumentation.MOVES_PROPOSED, proposed)
+        Instrumentation.count(Instrumentation.MOVES_ACCEPTED, accepted)
+        Instrumentation.count(Instrumentation.MOVES_REJECTED, proposed - accepted)
+        return best_order
+
+    def find_solution(self):
+        if self.__candidates is None:
+            with Instrumentation.phase("neighbour_lists"):
+                if self.colours.metric.is_euclidean():
+                    self.__points = [tuple(point) for point in self.colours.coordinates.tolist()]
+                else:
+                    self.__matrix = self.colours.get_distance_matrix()
+                self.__candidates = self.colours.get_nearest_neighbours(self.neighbours).tolist()
+        order = self.get_starting_order(self.starting_solution, self.random)
+        with Instrumentation.phase("annealing"):
+            self.anneal(order)
+
+
+class IteratedLocalSearch(Algorithm):
+    """
+    Iterated local search: the local optimum found by LocalSearch is repeatedly perturbed with a
+    double-bridge move and optimised again, keeping the result whenever it is shorter.
+    Only the colours around the perturbation are revisited by the local search after each kick.
+    """
+    KICKS = 500
+    PERTURBATION_LENGTH = 30
+
+    def __init__(self, kicks: int = KICKS, neighbours: int = LocalSearch.NEIGHBOURS,
+                 perturbation_length: int = PERTURBATION_LENGTH,
+                 starting_solution: StartingSolution = StartingSolution.GREEDY, seed: int = None):
+        """
+        :param kicks: the number of perturbations of each run.
+        :param neighbours: the number of nearest neighbours considered by the local search.
+        :param perturbation_length: the maximum length of each segment exchanged by the double-bridge move.
+        :param starting_solution: the ordering each run starts from.
+        :param seed: the seed of the random generator. If None, it is drawn from the global random generator.
+        """
+        super(IteratedLocalSearch, self).__init__()
+        self.kicks = kicks
+        self.neighbours = neighbours
+        self.perturbation_length = perturbation_length
+        self.starting_solution = starting_solution
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
+        self.__local_search = None
+
+    def reset(self):
+        super(IteratedLocalSearch, self).reset()
+        self.__local_search = None
+
+    def double_bridge(self, order: List[int]) -> (List[int], List[int]):
+        """
+        Exchange two random consecutive segments of the order: A B C D becomes A C B D.
+        :return: the perturbed order and the colours at the ends of the changed edges.
+        """
+        size = len(order)
+        if size < 4:
+            return list(order), list(order)
+        first = self.random.randrange(1, size - 1)
+        second = min(first + self.random.randint(1, self.perturbation_length), size - 1)
+        third = min(second + self.random.randint(1, self.perturbation_length), size)
+        perturbed = order[:first] + order[second:third] + order[first:second] + order[third:]
+        ends = [order[position] for position in (first - 1, first, second - 1, second, third - 1, third)
+                if position < size]
+        return perturbed, ends
+
+    def reseed(self, seed: int):
+        super(IteratedLocalSearch, self).reseed(seed)
+        if self.__local_search is not None:
+            self.__local_search.reseed(self.random.getrandbits(64))
+
+    def find_solution(self):
+        if self.__local_search is None:
+            self.__local_search = LocalSearch(self.neighbours, self.random.getrandbits(64))
+            self.__local_search.colours = self.colours
+
+        order = self.__local_search.optimise(self.get_starting_order(self.starting_solution, self.random),
+                                             is_stopped=self.is_stopped)
+        distance = self.colours.get_path_distance(order)
+        # The local optimum is saved after the first descent and after every kick that improves it, so that a
+        # solution is available at any time
+        self.save_solution(AlgorithmSolution(self.colours, distance, order))
+        for _ in range(self.kicks):
+            if self.is_stopped():
+                break
+            perturbed, ends = self.double_bridge(order)
+            candidate = self.__local_search.optimise(perturbed, ends, self.is_stopped)
+            candidate_distance = self.colours.get_path_distance(candidate)
+            if candidate_distance < distance:
+                order, distance = candidate, candidate_distance
+                self.save_solution(AlgorithmSolution(self.colours, distance, order))
+
+
+class SpaceFillingCurve(Algorithm):
+    """
+    Order the colours along a space-filling curve through the bounding cube of their coordinates in O(N log N).
+    The coordinates are quantised to 2^bits cells per axis, and the colours are sorted by the index of their cell
+    along the curve. Consecutive cells of the Hilbert curve are always adjacent, while the Morton (Z-order) curve
+    is cheaper to compute but jumps between distant cells. An optional windowed 2-opt pass then reverses the
+    short segments of the order whose reversal shortens it.
+    """
+
+    class Curve(Enum):
+        HILBERT = 0,
+        MORTON = 1
+
+    BITS = 10  # the bits of each quantised coordinate, at most 21 so that the index along the curve fits in 64 bits
+    MAX_PASSES = 50  # the maximum number of windowed 2-opt passes
+    EPSILON = 1e-12
+
+    def __init__(self, curve: Curve = Curve.HILBERT, window: int = 0, bits: int = BITS):
+        """
+        :param curve: the curve the colours are ordered along.
+        :param window: the maximum length of the segments reversed by the 2-opt pass, which is skipped if
+        the window is shorter than 2.
+        :param bits: the bits of each quantised coordinate, between 1 and 21.
+        """
+        super(SpaceFillingCurve, self).__init__()
+        assert 1 <= bits <= 21, "The quantised coordinates must have between 1 and 21 bits."
+        self.curve = curve
+        self.window = window
+        self.bits = bits
+
+    # PRIVATE METHODS
+
+    @staticmethod
+    def __spread_bits(values: np.ndarray) -> np.ndarray:
+        """Insert two zero bits above each of the lowest 21 bits of the values."""
+        values = values.astype(np.uint64) & np.uint64(0x1fffff)
+        for shift, mask in ((32, 0x1f00000000ffff), (16, 0x1f0000ff0000ff), (8, 0x100f00f00f00f00f),
+                            (4, 0x10c30c30c30c30c3), (2, 0x1249249249249249)):
+            values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+        return values
+
+    # PUBLIC METHODS
+
+    @staticmethod
+    def get_cells(coordinates: np.ndarray, bits: int) -> np.ndarray:
+        """
+        Quantise the coordinates to the cells of a grid of 2^bits cells per axis spanning their bounding cube.
+        :return: the N x 3 int64 array of the cell coordinates.
+        """
+        low = coordinates.min(axis=0)
+        span = float(np.max(coordinates.max(axis=0) - low))
+        if span <= 0:
+            # All the colours are the same, so they fall in the first cell
+            span = 1.0
+        cells = np.floor((coordinates - low) * ((1 << bits) / span)).astype(np.int64)
+        return np.minimum(cells, (1 << bits) - 1)
+
+    @staticmethod
+    def get_morton_indexes(cells: np.ndarray) -> np.ndarray:
+        """Get the indexes along the Morton curve of N x 3 cell coordinates, which interleave their bits."""
+        spread = SpaceFillingCurve.__spread_bits
+        return (spread(cells[:, 0]) << np.uint64(2)) | (spread(cells[:, 1]) << np.uint64(1)) | spread(cells[:, 2])
+
+    @staticmethod
+    def get_hilbert_indexes(cells: np.ndarray, bits: int) -> np.ndarray:
+        """
+        Get the indexes along the Hilbert curve of N x 3 cell coordinates of the given number of bits.
+        Skilling's transform ("Programming the Hilbert curve", 2004) turns the coordinates into the transposed
+        Hilbert index, whose bits are then interleaved, with one array operation per bit and axis.
+        """
+        axes = [cells[:, axis].astype(np.uint64) for axis in range(3)]
+        zero = np.uint64(0)
+
+        # Inverse undo
+        q = 1 << (bits - 1)
+        while q > 1:
+            p = np.uint64(q - 1)
+            for axis in range(3):
+                invert = (axes[axis] & np.uint64(q)) != 0
+                axes[0] = np.where(invert, axes[0] ^ p, axes[0])
+                exchange = np.where(invert, zero, (axes[0] ^ axes[axis]) & p)
+                axes[0] ^= exchange
+                axes[axis] ^= exchange
+            q >>= 1
+
+        # Gray encode
+        for axis in range(1, 3):
+            axes[axis] ^= axes[axis - 1]
+        flips = np.zeros(len(cells), dtype=np.uint64)
+        q = 1 << (bits - 1)
+        while q > 1:
+            flips ^= np.where((axes[2] & np.uint64(q)) != 0, np.uint64(q - 1), zero)
+            q >>= 1
+        for axis in range(3):
+            axes[axis] ^= flips
+        return SpaceFillingCurve.get_morton_indexes(np.stack(axes, axis=1))
+
+    def two_opt(self, order: np.ndarray) -> np.ndarray:
+        """
+        Improve the order with windowed 2-opt passes. Each pass scores the reversals of all the segments up to the
+        window length at once, then applies the best reversal of each position, from the first to the last,
+        skipping those that overlap a reversal already applied. The next pass only scores the reversals that
+        overlap the ones applied, so the passes get cheaper as the order converges.
+        :return: the improved order.
+        """
+        coordinates = self.colours.coordinates
+        metric = self.colours.metric
+        order = np.array(order, dtype=np.intp)
+        size = len(order)
+
+        def distances(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+            """Get the distances between the colours at the two arrays of positions of the path."""
+            return metric.get_distances(path[first], path[second])
+
+        # Reversing the positions from start + 1 to start + length replaces the edges (start, start + 1) and
+        # (start + length, start + length + 1), so it needs start + length + 1 < size
+        active = np.ones(max(0, size - 3), dtype=bool)  # the starts whose reversals are scored by the next pass
+        proposed = accepted = 0
+        for _ in range(self.MAX_PASSES):
+            starts = np.flatnonzero(active)
+            if len(starts) == 0 or self.is_stopped():
+                break
+
+            # Gathering the coordinates in the order of the path once keeps the accesses of every pass sequential
+            path = coordinates[order]
+            first_edges = distances(starts, starts + 1)
+            best_deltas = np.full(len(starts), inf)
+            best_lengths = np.zeros(len(starts), dtype=np.intp)
+            for length in range(2, min(self.window, size - 2) + 1):
+                valid = np.flatnonzero(starts + length + 1 < size)
+                start, end = starts[valid], starts[valid] + length
+                deltas = distances(start, end) + distances(start + 1, end + 1) - first_edges[valid] - \
+                    distances(end, end + 1)
+                proposed += len(deltas)
+                better = deltas < best_deltas[valid]
+                best_deltas[valid[better]] = deltas[better]
+                best_lengths[valid[better]] = length
+
+            selected = []
+            next_start = 0
+            for index in np.flatnonzero(best_deltas < -self.EPSILON).tolist():
+                if starts[index] >= next_start:
+                    selected.append(index)
+                    next_start = starts[index] + best_lengths[index] + 1
+            if not selected:
+                break
+
+            selected_starts, selected_lengths = starts[selected], best_lengths[selected]
+            for length in np.unique(selected_lengths).tolist():
+                positions = selected_starts[selected_lengths == length, np.newaxis] + 1 + np.arange(length)
+                order[positions] = order[positions[:, ::-1]]
+            accepted += len(selected)
+
+            # Activate the starts of the reversals that share a position with an applied one
+            changes = np.zeros(len(active) + 1, dtype=np.int64)
+            np.add.at(changes, np.maximum(0, selected_starts - self.window - 1), 1)
+            np.add.at(changes, np.minimum(len(active), selected_starts + selected_lengths + 2), -1)
+            active = np.cumsum(changes[:-1]) > 0
+
+        Instrumentation.count(Instrumentation.MOVES_PROPOSED, proposed)
+        Instrumentation.count(Instrumentation.MOVES_ACCEPTED, accepted)
+        Instrumentation.count(Instrumentation.MOVES_REJECTED, proposed - accepted)
+        return order
+
+    def find_order(self) -> np.ndarray:
+        """Get the indexes of the loaded colours in the order of the curve, improved by the windowed 2-opt pass."""
+        if len(self.colours) == 0:
+            return np.empty(0, dtype=np.intp)
+        with Instrumentation.phase("curve"):
+            cells = self.get_cells(self.colours.coordinates, self.bits)
+            indexes = self.get_hilbert_indexes(cells, self.bits) \
+                if self.curve == SpaceFillingCurve.Curve.HILBERT else self.get_morton_indexes(cells)
+            order = np.argsort(indexes, kind='stable')
+        if self.window >= 2:
+            with Instrumentation.phase("windowed_two_opt"):
+                order = self.two_opt(order)
+        return order
+
+    def find_solution(self):
+        self.save_solution(AlgorithmSolution(self.colours, order=self.find_order()))
+
+
+class DivideAndConquer(Algorithm):
+    """
+    Partition the colours into spatially coherent clusters with k-means, order each cluster independently,
+    then order the clusters by their centres and join the orders of consecutive clusters.
+    Each cluster order is treated as a cycle, which is cut and oriented so that it is entered from the end of
+    the previous cluster and left towards the centre of the next one along the shortest junctions.
+    With more than one worker, the clusters are ordered in a pool of processes.
+    """
+    CLUSTER_SIZE = 200
+    K_MEANS_ITERATIONS = 10
+    MAX_BLOCK_ELEMENTS = 2 ** 22  # the maximum number of colour to centre distances held in memory at once
+
+    def __init__(self, cluster_size: int = CLUSTER_SIZE, cluster_algorithm: AlgorithmType = AlgorithmType.HILL_CLIMBING,
+                 workers: int = 1, seed: int = None):
+        """
+        :param cluster_size: the mean number of colours of each cluster.
+        :param cluster_algorithm: GREEDY_CONSTRUCTIVE to order each cluster with a greedy tour, or HILL_CLIMBING
+        to improve the greedy tour with best-improvement 2-opt.
+        :param workers: the number of worker processes used to order the clusters.
+        :param seed: the seed of the random generators of the greedy tour and the hill climbing of every cluster.
+        If None, it is drawn from the global random generator.
+        """
+        super(DivideAndConquer, self).__init__()
+        assert cluster_algorithm in (AlgorithmType.GREEDY_CONSTRUCTIVE, AlgorithmType.HILL_CLIMBING), \
+            f"Unsupported cluster algorithm {cluster_algorithm.name}"
+        self.cluster_size = cluster_size
+        self.cluster_algorithm = cluster_algorithm
+        self.workers = workers
+        self.random = random.Random(seed if seed is not None else random.getrandbits(64))
+
+    # PRIVATE METHODS
+
+    def __join(self, cluster_orders: List[np.ndarray], centres: np.ndarray) -> np.ndarray:
+        """
+        Join the orders of the clusters, given in the order the clusters are visited.
+        :param centres: the coordinates of the centres of the clusters, in the same order.
+        """
+        coordinates = self.colours.coordinates
+        metric = self.colours.metric
+        path = []
+        previous = None
+        for position, cycle in enumerate(cluster_orders):
+            points = coordinates[cycle]
+            # Entering the cycle at colour j forwards cuts the edge (j - 1, j) and leaves from j - 1,
+            # entering it backwards cuts the edge (j, j + 1) and leaves from j + 1
+            edges_after = metric.get_distances(points, np.roll(points, -1, axis=0))
+            edges_before = np.roll(edges_after, 1)
+            entry = 0.0 if previous is None else metric.get_distances(coordinates[previous], points)
+            leaving = np.zeros(len(cycle)) if position == len(cluster_orders) - 1 \
+                else metric.get_distances(points, centres[position + 1])
+            forward = entry - edges_before + np.roll(leaving, 1)
+            backward = entry - edges_after + np.roll(leaving, -1)
+
+            start = int(np.argmin(np.minimum(forward, backward)))
+            if forward[start] <= backward[start]:
+                path.append(np.roll(cycle, -start))
+            else:
+                path.append(np.roll(cycle[::-1], start + 1 - len(cycle)))
+            previous = path[-1][-1]
+        return np.concatenate(path)
+
+    # PUBLIC METHODS
+
+    @staticmethod
+    def k_means(points: np.ndarray, clusters: int, initial_labels: np.ndarray,
+                iterations: int = K_MEANS_ITERATIONS, max_block_elements: int = MAX_BLOCK_ELEMENTS) -> np.ndarray:
+        """
+        Partition the points with Lloyd's k-means algorithm, assigning the points to their nearest centres in
+        blocks of rows so that memory use stays bounded.
+        :param points: the N x 3 coordinates.
+        :param clusters: the number of clusters.
+        :param initial_labels: the cluster of every point the first centres are computed from.
+        :return: the cluster of every point. Clusters that end up empty are dropped, so the clusters are
+        numbered from 0 without gaps.
+        """
+        labels = initial_labels
+        block_size = max(1, max_block_elements // max(1, clusters))
+        for _ in range(iterations):
+            counts = np.bincount(labels, minlength=clusters)
+            sums = np.stack([np.bincount(labels, points[:, axis], clusters) for axis in range(3)], axis=1)
+            centres = sums[counts > 0] / counts[counts > 0, np.newaxis]
+
+            squared_norms = np.sum(centres ** 2, axis=1)
+            new_labels = np.empty(len(points), dtype=np.intp)
+            for start in range(0, len(points), block_size):
+                block = points[start:start + block_size]
+                new_labels[start:start + block_size] = np.argmin(squared_norms - 2 * block @ centres.T, axis=1)
+            Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, len(points) * len(centres))
+
+            converged = len(centres) == clusters and np.array_equal(new_labels, labels)
+            labels, clusters = new_labels, len(centres)
+            if converged:
+                break
+        return np.unique(labels, return_inverse=True)[1]
+
+    @staticmethod
+    def order_cluster(colours: ColoursList, cluster_algorithm: AlgorithmType, seed: int) -> np.ndarray:
+        """
+        Order the colours of a cluster with a greedy tour over their distance matrix, which the hill climbing
+        then reuses.
+        :return: the indexes of the colours in the order found.
+        """
+        greedy = GreedyConstructive(seed=seed)
+        greedy.colours = colours
+        order = np.array(greedy.find_matrix_order(), dtype=np.intp)
+        if cluster_algorithm == AlgorithmType.HILL_CLIMBING and len(colours) > 2:
+            climber = HillClimbing(seed, HillClimbing.Strategy.BEST_IMPROVEMENT)
+            climber.colours = colours.permute(order)
+            climber.find_solution()
+            order = order[climber.best_order]
+        return order
+
+    @staticmethod
+    def order_cluster_values(values: np.ndarray, metric: Metric, cluster_algorithm: AlgorithmType, seed: int,
+                             instrumented: bool = False) -> (np.ndarray, dict):
+        """
+        Order the colours of a cluster in a worker process.
+        :return: the order of the colours and the instrumentation counters.
+        """
+        instrumentation = Instrumentation(instrumented)
+        with instrumentation.activate():
+            order = DivideAndConquer.order_cluster(ColoursList(values, metric=metric), cluster_algorithm, seed)
+        return order, instrumentation.counters
+
+    def find_order(self) -> np.ndarray:
+        """Get the indexes of the loaded colours in the order of the clusters."""
+        size = len(self.colours)
+        cluster_count = -(-size // max(1, self.cluster_size))
+        if cluster_count <= 1:
+            return self.order_cluster(self.colours, self.cluster_algorithm, self.random.getrandbits(64))
+
+        with Instrumentation.phase("clustering"):
+            # The clusters start from consecutive runs of colours along the Hilbert curve
+            curve = SpaceFillingCurve()
+            curve.colours = self.colours
+            initial_labels = np.empty(size, dtype=np.intp)
+            initial_labels[curve.find_order()] = np.arange(size) * cluster_count // size
+            labels = self.k_means(self.colours.coordinates, cluster_count, initial_labels)
+            members = np.argsort(labels, kind='stable')
+            clusters = np.split(members, np.cumsum(np.bincount(labels))[:-1])
+
+        with Instrumentation.phase("cluster_orders"):
+            seeds = [self.random.getrandbits(64) for _ in clusters]
+            if self.workers <= 1:
+                orders = [self.order_cluster(self.colours.permute(cluster), self.cluster_algorithm, seed)
+                          for cluster, seed in zip(clusters, seeds)]
+            else:
+                orders = []
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    results = executor.map(DivideAndConquer.order_cluster_values,
+                                           [self.colours.values[cluster] for cluster in clusters],
+                                           repeat(self.metric), repeat(self.cluster_algorithm), seeds,
+                                           repeat(self.instrumentation.enabled))
+                    for order, counters in results:
+                        self.instrumentation.merge(counters)
+                        orders.append(order)
+
+        with Instrumentation.phase("joining"):
+            centres = ColoursList(np.stack([self.colours.values[cluster].mean(axis=0) for cluster in clusters]),
+                                  metric=self.metric)
+            visits = self.order_cluster(centres, self.cluster_algorithm, self.random.getrandbits(64))
+            return self.__join([clusters[cluster][orders[cluster]] for cluster in visits],
+                               centres.coordinates[visits])
+
+    def find_solution(self):
+        self.save_solution(AlgorithmSolution(self.colours, order=self.find_order()))
+
+
+class GeneticAlgorithm(Algorithm):
+    """
+    Genetic algorithm whose population is a P x N int32 array of permutations of the loaded colours, so that every
+    generation is evolved with array operations: the fitness of all the individuals is a single gather and sum over
+    the coordinates, and the selection, crossover and mutation of all the children are batched.
+    With more than one worker, the fitness of the children is evaluated in a pool of processes.
+    """
+
+    class Crossover(Enum):
+        ORDER = 0,  # copy a segment of the first parent and the other colours in the order of the second one
+        EDGE_RECOMBINATION = 1  # build the child from the edges of both parents
+
+    POPULATION_SIZE = 100
+    GENERATIONS = 200
+    MUTATION_RATE = 0.2
+    TOURNAMENT_SIZE = 3
+    ELITES = 2
+
+    __worker_colours = None  # the colours whose orders are evaluated by a worker process
+
+    def __init__(self, crossover: Crossover = Crossover.ORDER, population_size: int = POPULATION_SIZE,
+                 generations: int = GENERATIONS, mutation_rate: float = MUTATION_RATE,
+                 tournament_size: int = TOURNAMENT_SIZE, elites: int = ELITES,
+                 starting_solution: StartingSolution = StartingSolution.GREEDY, workers: int = 1, seed: int = None):
+        """
+        :param crossover: how the children are built from their parents.
+        :param population_size: the number of individuals of every generation.
+        :param generations: the number of generations of each run.
+        :param mutation_rate: the probability of a child to have a random range of colours reversed (2-opt move).
+        :param tournament_size: the number of individuals competing to be selected as each parent.
+        :param elites: the number of best individuals copied unchanged to the next generation.
+        :param starting_solution: GREEDY to start half of the population from greedy tours from random colours,
+        LOADED or CURVE to start one individual from that order. The other individuals are random.
+        :param workers: the number of worker processes used to evaluate the fitness.
+        :param seed: the seed of the random generator. If None, it is drawn from the global random generator.
+        """
+        super(GeneticAlgorithm, self).__init__()
+        self.crossover = crossover
+        self.population_size = population_size
+        self.generations = generations
+        self.mutation_rate = mutation_rate
+        self.tournament_size = tournament_size
+        self.elites = elites
+        self.starting_solution = starting_solution
+        self.workers = workers
+        self.random = np.random.default_rng(seed if seed is not None else random.getrandbits(64))
+
+    # PRIVATE METHODS
+
+    def __select(self, fitness: np.ndarray, count: int) -> np.ndarray:
+        """Select the given number of individuals, each the fittest of a random tournament."""
+        contestants = self.random.integers(0, len(fitness), (count, self.tournament_size))
+        return contestants[np.arange(count), np.argmin(fitness[contestants], axis=1)]
+
+    @staticmethod
+    def __get_neighbours(population: np.ndarray) -> np.ndarray:
+        """
+        Get the colours before and after every colour in every order of the population.
+        :return: a P x N x 2 array, -1 where the colour is at an end of the order.
+        """
+        count, size = population.shape
+        rows = np.arange(count)[:, np.newaxis]
+        positions = np.empty_like(population)
+        positions[rows, population] = np.arange(size, dtype=population.dtype)
+        padded = np.pad(population, ((0, 0), (1, 1)), constant_values=-1)
+        return np.stack((padded[rows, positions], padded[rows, positions + 2]), axis=2)
+
+    # PUBLIC METHODS
+
+    @staticmethod
+    def load_worker_colours(values: np.ndarray, metric: Metric):
+        """Initialise a worker process with the colours it evaluates the orders of."""
+        GeneticAlgorithm.__worker_colours = ColoursList(values, metric=metric)
+
+    @staticmethod
+    def evaluate_in_worker(population: np.ndarray) -> np.ndarray:
+        return GeneticAlgorithm.__worker_colours.get_path_distances(population)
+
+    def reseed(self, seed: int):
+        self.random = np.random.default_rng(seed)
+
+    def evaluate(self, population: np.ndarray, executor: ProcessPoolExecutor = None) -> np.ndarray:
+        """Get the total distance of every order of the population."""
+        if executor is None:
+            return self.colours.get_path_distances(population)
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, population.shape[0] * (population.shape[1] - 1))
+        return np.concatenate(list(executor.map(GeneticAlgorithm.evaluate_in_worker,
+                                                np.array_split(population, self.workers))))
+
+    def get_initial_population(self) -> np.ndarray:
+        size = len(self.colours)
+        population = np.argsort(self.random.random((self.population_size, size)), axis=1).astype(np.int32)
+        if self.starting_solution == StartingSolution.GREEDY:
+            greedy = GreedyConstructive(seed=int(self.random.integers(2 ** 63)))
+            greedy.colours = self.colours
+            starts = self.random.choice(size, min(self.population_size // 2, size), replace=False)
+            population[:len(starts)] = greedy.find_batch_orders(starts)
+        elif self.starting_solution != StartingSolution.RANDOM:
+            population[0] = self.get_starting_order(self.starting_solution,
+                                                    random.Random(int(self.random.integers(2 ** 63))))
+        return population
+
+    def order_crossover(self, parents1: np.ndarray, parents2: np.ndarray) -> np.ndarray:
+        """
+        Build every child from a random segment of its first parent, with the colours that are not in the segment
+        in the order they have in the second parent, starting after the segment.
+        """
+        count, size = parents1.shape
+        rows = np.arange(count)[:, np.newaxis]
+        cuts = np.sort(self.random.integers(0, size + 1, (count, 2)), axis=1)
+        positions = np.arange(size)
+        in_segment = (positions >= cuts[:, :1]) & (positions < cuts[:, 1:])
+
+        children = np.where(in_segment, parents1, -1).astype(np.int32)
+        taken = np.zeros((count, size), dtype=bool)
+        taken[np.nonzero(in_segment)[0], parents1[in_segment]] = True
+
+        # Visit the positions and the colours of the second parent from the end of the segment onwards
+        rotated = (cuts[:, 1:] + positions) % size
+        second = parents2[rows, rotated]
+        free = ~in_segment[rows, rotated]
+        children[np.nonzero(free)[0], rotated[free]] = second[~taken[rows, second]]
+        return children
+
+    def edge_recombination(self, parents1: np.ndarray, parents2: np.ndarray) -> np.ndarray:
+        """
+        Build every child from the edges of its parents. All the children are built in lockstep, one colour per
+        step: the next colour is the neighbour of the current one in either parent with the fewest unvisited
+        neighbours left, ties broken at random, or a random unvisited colour if all its neighbours are visited.
+        """
+        count, size = parents1.shape
+        rows = np.arange(count)
+        neighbours = np.concatenate((self.__get_neighbours(parents1), self.__get_neighbours(parents2)), axis=2)
+        visited = np.zeros((count, size + 1), dtype=bool)
+        visited[:, -1] = True  # the missing neighbours, -1, are always visited
+        children = np.empty((count, size), dtype=np.int32)
+        current = parents1[:, 0]
+        for step in range(size):
+            children[:, step] = current
+            visited[rows, current] = True
+            if step == size - 1:
+                break
+
+            candidates = neighbours[rows, current]
+            available = ~visited[rows[:, np.newaxis], candidates]
+            remaining = np.sum(~visited[rows[:, np.newaxis, np.newaxis], neighbours[rows[:, np.newaxis], candidates]],
+                               axis=2)
+            scores = np.where(available, remaining + self.random.random(candidates.shape), inf)
+            current = candidates[rows, np.argmin(scores, axis=1)]
+
+            stuck = np.flatnonzero(~np.any(available, axis=1))
+            if len(stuck) > 0:
+                keys = self.random.random((len(stuck), size))
+                keys[visited[stuck, :-1]] = inf
+                current[stuck] = np.argmin(keys, axis=1)
+        return children
+
+    def mutate(self, population: np.ndarray):
+        """Reverse a random range of colours of randomly chosen orders of the population, in place."""
+        count, size = population.shape
+        mutated = np.flatnonzero(self.random.random(count) < self.mutation_rate)
+        ends = np.sort(self.random.integers(0, size, (len(mutated), 2)), axis=1)
+        positions = np.arange(size)
+        first, last = ends[:, :1], ends[:, 1:]
+        reversed_positions = np.where((positions >= first) & (positions <= last), first + last - positions, positions)
+        population[mutated] = np.take_along_axis(population[mutated], reversed_positions, axis=1)
+
+    def find_solution(self):
+        if len(self.colours) < 3:
+            self.save_solution(AlgorithmSolution(self.colours))
+            return
+
+        crossover = self.order_crossover if self.crossover == GeneticAlgorithm.Crossover.ORDER \
+            else self.edge_recombination
+        with ProcessPoolExecutor(self.workers, initializer=GeneticAlgorithm.load_worker_colours,
+                                 initargs=(self.colours.values, self.metric)) \
+                if self.workers > 1 else nullcontext() as executor:
+            with Instrumentation.phase("initial_population"):
+                population = self.get_initial_population()
+                fitness = self.evaluate(population, executor)
+            # The fittest individual is saved whenever a generation improves it, so that a solution is available
+            # at any time
+            best = int(np.argmin(fitness))
+            self.save_solution(AlgorithmSolution(self.colours, float(fitness[best]), population[best]))
+            saved_distance = fitness[best]
+
+            with Instrumentation.phase("generations"):
+                for _ in range(self.generations):
+                    if self.is_stopped():
+                        break
+                    elites = np.argsort(fitness)[:self.elites]
+                    count = self.population_size - len(elites)
+                    children = crossover(population[self.__select(fitness, count)],
+                                         population[self.__select(fitness, count)])
+                    self.mutate(children)
+                    population = np.concatenate((population[elites], children))
+                    fitness = np.concatenate((fitness[elites], self.evaluate(children, executor)))
+                    best = int(np.argmin(fitness))
+                    if fitness[best] < saved_distance:
+                        self.save_solution(AlgorithmSolution(self.colours, float(fitness[best]), population[best]))
+                        saved_distance = fitness[best]
@@ -0,0 +1,210 @@
+import argparse
+import json
+import platform
+import random
+import sys
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from Algorithms import Algorithm, AlgorithmType
+from Colour import ColoursList, ColourUtils, DistanceMatrix
+from TestRunner import Benchmark
+from Utils import Assert, File, Time
+
+
+class KernelResult(object):
+    """
+    The timings of the trials of a single kernel.
+    """
+
+    def __init__(self, name: str, times: List[int], operations: int):
+        """
+        :param name: the name of the kernel.
+        :param times: the duration of each trial in nanoseconds.
+        :param operations: the number of operations performed by each trial.
+        """
+        self.name = name
+        self.times = times
+        self.operations = operations
+
+    def get_median(self) -> float:
+        return float(np.median(self.times))
+
+    def get_iqr(self) -> float:
+        """Get the interquartile range of the trials durations."""
+        first_quartile, third_quartile = np.percentile(self.times, [25, 75])
+        return float(third_quartile - first_quartile)
+
+    def get_throughput(self) -> float:
+        """Get the number of operations per second, based on the median duration."""
+        return self.operations / (self.get_median() / 1e9)
+
+    def to_dict(self) -> dict:
+        return {
+            "median_ns": self.get_median(),
+            "iqr_ns": self.get_iqr(),
+            "min_ns": min(self.times),
+            "max_ns": max(self.times),
+            "throughput": self.get_throughput(),
+            "operations": self.operations,
+            "trials": len(self.times),
+        }
+
+
+class BenchmarkSuite(object):
+    """
+    Micro and macro benchmarks for the colour kernels and the algorithms.
+    Every kernel is run a number of warm-up times, then timed over repeated trials with perf_counter_ns.
+    The random generators are reset to the same seed and the distance matrices loaded by the previous runs are
+    forgotten before each run, so every trial does the same work, including computing the matrices it uses.
+    """
+    ALGORITHMS = [
+        AlgorithmType.GREEDY_CONSTRUCTIVE,
+        AlgorithmType.HILL_CLIMBING,
+        AlgorithmType.LOCAL_SEARCH,
+        AlgorithmType.DELTA_SORT,
+    ]
+    NEAREST_COLOUR_QUERIES = 100
+
+    def __init__(self, colours: ColoursList, seed: int = 0, warmup: int = 3, trials: int = 15):
+        """
+        :param colours: the colours the benchmark subsets are drawn from.
+        :param seed: the seed of the random generators.
+        :param warmup: the number of untimed runs before the trials.
+        :param trials: the number of timed runs of each kernel.
+        """
+        self.colours = colours
+        self.seed = seed
+        self.warmup = warmup
+        self.trials = trials
+        self.kernels = []
+        self.results = []
+
+    def __reset_random(self):
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+
+    def __reset(self):
+        self.__reset_random()
+        DistanceMatrix.clear_cache()
+
+    def get_subset(self, subset_size: int) -> ColoursList:
+        """Get the same random subset of the colours for every call."""
+        self.__reset_random()
+        return self.colours.random_permutation(subset_size)
+
+    def add_kernel(self, name: str, function: Callable[[], object], operations: int = 1):
+        """
+        Add a kernel to the suite.
+        :param name: the unique name of the kernel, used to compare it against the baseline.
+        :param function: the function to time.
+        :param operations: the number of operations performed by each call, used for the throughput.
+        """
+        self.kernels.append((name, function, operations))
+
+    def add_default_kernels(self, subset_sizes: List[int] = (100, 500)):
+        """Add the distance, nearest colour and algorithm kernels for every subset size."""
+        for subset_size in subset_sizes:
+            colours = self.get_subset(subset_size)
+            queries = [colours.get(i % subset_size) for i in range(self.NEAREST_COLOUR_QUERIES)]
+
+            self.add_kernel(f"total_distance_{subset_size}",
+                            lambda colours=colours: ColourUtils.get_total_distance(colours))
+            self.add_kernel(f"nearest_euclidean_{subset_size}",
+                            lambda colours=colours, queries=queries:
+                            [colours.get_nearest_colour_euclidean(query) for query in queries],
+                            len(queries))
+            self.add_kernel(f"nearest_delta_e_{subset_size}",
+                            lambda colours=colours, queries=queries:
+                            [colours.get_nearest_colour_delta_e(query) for query in queries],
+                            len(queries))
+
+            for algorithm_type in self.ALGORITHMS:
+                self.add_kernel(f"{algorithm_type.name.lower()}_{subset_size}",
+                                lambda colours=colours, algorithm_type=algorithm_type: Benchmark.run_algorithm(
+                                    Algorithm.factory(algorithm_type), colours, 1, self.seed))
+
+    def run(self) -> List[KernelResult]:
+        Assert.not_empty(self.kernels, "The kernels list cannot be empty. Please add kernels.")
+        self.results = []
+        for name, function, operations in self.kernels:
+            for _ in range(self.warmup):
+                self.__reset()
+                function()
+
+            times = []
+            for _ in range(self.trials):
+                self.__reset()
+                start = Time.get_timestamp_nanos()
+                function()
+                times.append(Time.get_timestamp_nanos() - start)
+
+            result = KernelResult(name, times, operations)
+            self.results.append(result)
+            print(f"{name}: median {result.get_median() / 1e6:.3f} ms, IQR {result.get_iqr() / 1e6:.3f} ms, "
+                  f"{result.get_throughput():.1f} ops/s")
+        return self.results
+
+    def to_dict(self) -> dict:
+        return {
+            "metadata": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "seed": self.seed,
+                "warmup": self.warmup,
+                "trials": self.trials,
+            },
+            "kernels": {result.name: result.to_dict() for result in self.results},
+        }
+
+    def save(self, filename: str):
+        with open(filename, 'w') as output:
+            json.dump(self.to_dict(), output, indent=2)
+
+    @staticmethod
+    def compare(results: dict, baseline: dict, threshold: float) -> Dict[str, float]:
+        """
+        Compare the median of every kernel against the baseline.
+        :param results: the current results, as returned by to_dict.
+        :param baseline: the baseline results, in the same format.
+        :param threshold: the allowed relative slowdown, e.g. 0.1 for 10%.
+        :return: the relative slowdown of the kernels that exceed the threshold.
+        """
+        regressions = {}
+        for name, kernel in results["kernels"].items():
+            if name not in baseline["kernels"]:
+                continue
+            slowdown = kernel["median_ns"] / baseline["kernels"][name]["median_ns"] - 1
+            if slowdown > threshold:
+                regressions[name] = slowdown
+        return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the colour kernels and the algorithms.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500], help="the colour subset sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--trials", type=int, default=15)
+    parser.add_argument("--output", default="results/benchmarks.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="a JSON results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="the allowed relative slowdown")
+    arguments = parser.parse_args()
+
+    File.change_dir(File.get_current_dir())
+    colours = File.load_colours('colours.txt')
+
+    suite = BenchmarkSuite(ColourUtils.list_from_tuple_list(colours), arguments.seed, arguments.warmup,
+                           arguments.trials)
+    suite.add_default_kernels(arguments.sizes)
+    suite.run()
+    suite.save(arguments.output)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            regressions = BenchmarkSuite.compare(suite.to_dict(), json.load(baseline_file), arguments.threshold)
+        for kernel_name, kernel_slowdown in regressions.items():
+            print(f"Regression in {kernel_name}: {kernel_slowdown * 100:.1f}% slower than the baseline")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,124 @@
+from math import inf
+
+import numpy as np
+
+from Colour import ColoursList, DistanceMatrix
+
+
+class LowerBound(object):
+    """
+    Lower bounds of the total distance of the shortest order of a palette, an open path through all its colours.
+    Every open path is a spanning tree, so the weight of the minimum spanning tree is a lower bound. The 1-tree
+    bound (Held and Karp, 1970) tightens it: a dummy colour at zero distance from all the others closes the path
+    into a cycle, and penalties added to the distances of every colour, adjusted by subgradient optimisation,
+    push the minimum 1-tree towards a path. Every set of penalties gives a valid bound, and the best one is kept.
+    """
+    ITERATIONS = 100
+    PATIENCE = 10  # the iterations without improvement after which the subgradient step is halved
+    EPSILON = 1e-9
+
+    __bounds = {}  # the 1-tree bounds computed by this process, by palette and metric
+
+    @staticmethod
+    def get_gap(distance: float, lower_bound: float) -> float:
+        """
+        Get the gap between a total distance and a lower bound, relative to the bound. The bound is computed from the
+        float32 distances of the matrix, so it can exceed the optimum by their rounding: the gap is clamped at 0.
+        """
+        if lower_bound <= 0:
+            return 0.0 if distance <= 0 else inf
+        return max((distance - lower_bound) / lower_bound, 0.0)
+
+    @staticmethod
+    def get_lower_bound(colours: ColoursList, upper_bound: float = None) -> float:
+        """
+        Get the 1-tree bound of the colours, measured with their metric, computed once for every palette and metric
+        by this process.
+        :param upper_bound: the total distance of a known order of the colours, used if the bound is computed.
+        """
+        key = DistanceMatrix.get_filename(colours, colours.metric)
+        if key not in LowerBound.__bounds:
+            LowerBound.__bounds[key] = LowerBound.one_tree(colours, upper_bound)
+        return LowerBound.__bounds[key]
+
+    @staticmethod
+    def get_spanning_tree(distances: DistanceMatrix, penalties: np.ndarray = None) -> (float, np.ndarray):
+        """
+        Get the minimum spanning tree of a complete graph with Prim's algorithm, updating the cost of joining every
+        vertex outside the tree with one array operation for each vertex added. Only the row of the vertex added
+        is read from the matrix, so the memory used is linear in the number of vertices.
+        :param distances: the weights of the edges.
+        :param penalties: the N penalties added to the weights of the edges of each vertex. If None, they are zero.
+        :return: the total weight of the tree and the degree of every vertex in it.
+        """
+        size = len(distances)
+        penalties = np.zeros(size) if penalties is None else penalties
+        degrees = np.zeros(size, dtype=np.int64)
+        if size < 2:
+            return 0.0, degrees
+
+        in_tree = np.zeros(size, dtype=bool)
+        in_tree[0] = True
+        costs = distances.get_row(0) + penalties + penalties[0]
+        costs[0] = inf
+        parents = np.zeros(size, dtype=np.intp)
+        weight = 0.0
+        for _ in range(size - 1):
+            vertex = int(np.argmin(costs))
+            weight += costs[vertex]
+            degrees[vertex] += 1
+            degrees[parents[vertex]] += 1
+            in_tree[vertex] = True
+            costs[vertex] = inf
+            vertex_costs = distances.get_row(vertex) + penalties + penalties[vertex]
+            closer = (vertex_costs < costs) & ~in_tree
+            costs[closer] = vertex_costs[closer]
+            parents[closer] = vertex
+        return float(weight), degrees
+
+    @staticmethod
+    def minimum_spanning_tree(colours: ColoursList) -> float:
+        """Get the weight of the minimum spanning tree of the colours, measured with their metric."""
+        return LowerBound.get_spanning_tree(colours.get_distance_matrix())[0]
+
+    @staticmethod
+    def one_tree(colours: ColoursList, upper_bound: float = None, iterations: int = ITERATIONS) -> float:
+        """
+        Get the 1-tree bound of the colours, measured with their metric.
+        :param upper_bound: the total distance of a known order of the colours, which scales the subgradient steps.
+        If None, twice the weight of the minimum spanning tree is used.
+        :param iterations: the maximum number of subgradient steps.
+        """
+        size = len(colours)
+        distances = colours.get_distance_matrix()
+        if size < 3:
+            # The only spanning trees are paths
+            return LowerBound.get_spanning_tree(distances)[0]
+
+        penalties = np.zeros(size)
+        best = 0.0
+        step = 2.0
+        stale = 0
+        for _ in range(iterations):
+            weight, degrees = LowerBound.get_spanning_tree(distances, penalties)
+            # The dummy colour is joined to the two colours with the smallest penalties
+            ends = np.argpartition(penalties, 1)[:2]
+            degrees[ends] += 1
+            bound = weight + float(np.sum(penalties[ends])) - 2 * float(np.sum(penalties))
+            if upper_bound is None:
+                upper_bound = 2 * weight
+
+            if bound > best + LowerBound.EPSILON:
+                best, stale = bound, 0
+            else:
+                stale += 1
+                if stale >= LowerBound.PATIENCE:
+                    step, stale = step / 2, 0
+
+            subgradient = degrees - 2
+            norm = int(np.sum(subgradient ** 2))
+            if norm == 0 or upper_bound - bound <= LowerBound.EPSILON:
+                # The 1-tree is a path, or the bound cannot get any closer to the known order
+                break
+            penalties += step * (upper_bound - bound) / norm * subgradient
+        return max(best, 0.0)
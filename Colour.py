@@ -1,24 +1,30 @@
 import copy
+import hashlib
+import os
 import random
+import threading
+from enum import Enum
 from functools import total_ordering
-from math import inf
+from math import inf, sqrt
 from typing import List
 
 import numpy as np
-from colormath.color_conversions import convert_color
-from colormath.color_diff import delta_e_cie2000
-from colormath.color_objects import sRGBColor, LabColor
 
-from Utils import Assert
+from Utils import Assert, Instrumentation
 
 
 @total_ordering
 class Colour(object):
+    """
+    A single RGB colour.
+    The coordinates live in a 3-element float64 array, which is either owned by the colour
+    or is a row read from a ColoursList.
+    """
+    __slots__ = ('rgb',)
+
     # BUILT-IN METHODS
     def __init__(self, red: float, green: float, blue: float):
-        self.red = float(red)
-        self.green = float(green)
-        self.blue = float(blue)
+        self.rgb = np.array((red, green, blue), dtype=np.float64)
 
     def __eq__(self, other: 'Colour'):
         return self.distance_from(other) == 0
@@ -29,15 +35,34 @@ class Colour(object):
     def __str__(self):
         return str(self.to_tuple())
 
-    # PRIVATE METHODS
-    def __to_lbc(self):
-        return convert_color(sRGBColor(self.red, self.green, self.blue), LabColor)
+    @property
+    def red(self) -> float:
+        return float(self.rgb[0])
+
+    @property
+    def green(self) -> float:
+        return float(self.rgb[1])
+
+    @property
+    def blue(self) -> float:
+        return float(self.rgb[2])
 
     # STATIC METHODS
     @staticmethod
     def calculate_distance(colour1: 'Colour', colour2: 'Colour') -> float:
-        s = (colour1.red - colour2.red) ** 2 + (colour1.green - colour2.green) ** 2 + (colour1.blue - colour2.blue) ** 2
-        return s ** (1 / 2) if s > 0 else 0
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS)
+        difference = colour1.rgb - colour2.rgb
+        return sqrt(difference.dot(difference))
+
+    @staticmethod
+    def from_array(rgb: np.ndarray) -> 'Colour':
+        """
+        Create a colour on top of an existing array of three coordinates without copying it.
+        :param rgb: the red, green and blue coordinates.
+        """
+        colour = Colour.__new__(Colour)
+        colour.rgb = rgb
+        return colour
 
     @staticmethod
     def get_white():
@@ -50,13 +75,16 @@ class Colour(object):
     # PUBLIC METHODS
 
     def clone(self):
-        return Colour(self.red, self.green, self.blue)
+        return Colour.from_array(self.rgb.copy())
 
     def distance_from(self, colour: 'Colour'):
         return self.calculate_distance(self, colour)
 
     def to_delta_e(self, other: 'Colour'):
-        return delta_e_cie2000(self.__to_lbc(), other.__to_lbc())
+        return float(DeltaE.cie2000(self.to_lab(), other.to_lab()))
+
+    def to_lab(self) -> np.ndarray:
+        return DeltaE.lab_from_rgb(self.rgb)
 
     def to_rgb(self):
         """
@@ -69,126 +97,667 @@ class Colour(object):
         return self.red, self.green, self.blue
 
 
+class Metric(Enum):
+    """
+    The distance between two colours: the euclidean distance between their RGB coordinates (EUCLIDEAN) or their
+    CIE Lab coordinates (CIE76), or the CIEDE2000 difference. CIE76 is euclidean in Lab space, so it is computed
+    with the same kernels as EUCLIDEAN, such as the spatial grid and the neighbour lists, applied to Lab coordinates.
+    """
+    EUCLIDEAN = 0,
+    CIE76 = 1,
+    CIEDE2000 = 2
+
+    def is_euclidean(self) -> bool:
+        """Check whether the distance is the euclidean distance between the coordinates of the metric."""
+        return self != Metric.CIEDE2000
+
+    def get_coordinates(self, colours: 'ColoursList') -> np.ndarray:
+        """Get the N x 3 array of the coordinates the distances between the colours are computed from."""
+        return colours.values if self == Metric.EUCLIDEAN else colours.lab
+
+    def get_distances(self, coordinates1: np.ndarray, coordinates2: np.ndarray) -> np.ndarray:
+        """
+        Calculate the distances between colours.
+        :param coordinates1: an array of shape (..., 3) of coordinates of the metric.
+        :param coordinates2: an array of shape (..., 3) broadcastable against coordinates1.
+        :return: the broadcast array of distances.
+        """
+        if not self.is_euclidean():
+            return DeltaE.cie2000(coordinates1, coordinates2)
+        distances = np.sqrt(np.sum((np.asarray(coordinates1) - coordinates2) ** 2, axis=-1))
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, np.size(distances))
+        return distances
+
+    def get_total_distance(self, coordinates: np.ndarray) -> float:
+        """Get the sum of the distances between consecutive colours, given their N x 3 array of coordinates."""
+        return float(np.sum(self.get_distances(coordinates[1:], coordinates[:-1])))
+
+
 class ColoursList(object):
-    colours: List[Colour]
+    """
+    A list of colours stored as a contiguous N x 3 float64 array.
+    Colours are only materialised as Colour objects when single elements are accessed.
+    The CIE Lab coordinates are computed once, on first use, and kept until the list is modified.
+    The distances between the colours of the list are measured with its metric, euclidean by default.
+    """
 
     # BUILT-IN METHODS
-    def __init__(self):
-        self.colours = []
+    def __init__(self, values: np.ndarray = None, lab: np.ndarray = None, metric: Metric = Metric.EUCLIDEAN):
+        if values is None:
+            values = np.empty((0, 3), dtype=np.float64)
+        self.__data = np.ascontiguousarray(values, dtype=np.float64).reshape(-1, 3)
+        self.__size = len(self.__data)
+        self.__lab = lab
+        self.__metric = metric
         self.total_distance = None
 
-    def __contains__(self, item):
-        for element in self.colours:
-            if element == item:
-                return True
-        return False
+    def __contains__(self, item: Colour):
+        return bool(np.any(self.__matches(item)))
 
     def __delitem__(self, key):
-        index = self.colours.index(key)
-        del self.colours[index]
+        index = key if isinstance(key, (int, np.integer)) else self.index(key)
+        self.__data = np.delete(self.values, index, axis=0)
+        self.__size = len(self.__data)
+        if self.__lab is not None:
+            self.__lab = np.delete(self.__lab, index, axis=0)
+        self.total_distance = None
 
-    def __eq__(self, other):
-        for i in range(len(self)):
-            if self.get(i) != other.get(i):
-                return False
-        return True
+    def __eq__(self, other: 'ColoursList'):
+        return np.array_equal(self.values, other.values)
 
     def __getitem__(self, index):
-        return self.colours[index]
+        if isinstance(index, slice):
+            # Fancy indexing copies, so the new list never shares its buffer with this one
+            return self.permute(np.arange(self.__size)[index])
+        return self.get(index)
+
+    def __iter__(self):
+        for rgb in self.values:
+            yield Colour.from_array(rgb.copy())
 
     def __len__(self):
-        return len(self.colours)
+        return self.__size
 
-    def __setitem__(self, key, value):
-        self.colours[key] = value
+    def __setitem__(self, key, value: Colour):
+        self.values[key] = value.rgb
+        self.__lab = None
+        self.total_distance = None
 
     def __str__(self):
-        for colour in self.get_all():
-            return colour
+        return str([colour.to_tuple() for colour in self])
 
     # PRIVATE METHODS
 
+    @staticmethod
+    def __distance(coordinates1: np.ndarray, coordinates2: np.ndarray) -> float:
+        difference = coordinates1 - coordinates2
+        return sqrt(difference.dot(difference))
+
+    def __matches(self, colour: Colour) -> np.ndarray:
+        return np.all(self.values == colour.rgb, axis=1)
+
     # PUBLIC METHODS
 
+    @property
+    def values(self) -> np.ndarray:
+        """The N x 3 array of colour coordinates."""
+        return self.__data[:self.__size]
+
+    @property
+    def lab(self) -> np.ndarray:
+        """The N x 3 array of CIE Lab coordinates of the colours."""
+        if self.__lab is None:
+            self.__lab = DeltaE.lab_from_rgb(self.values)
+        return self.__lab
+
+    @property
+    def metric(self) -> Metric:
+        """The metric the distances between the colours are measured with."""
+        return self.__metric
+
+    @metric.setter
+    def metric(self, metric: Metric):
+        if metric != self.__metric:
+            self.__metric = metric
+            self.total_distance = None
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        """The N x 3 array of the coordinates of the colours in the space of the metric."""
+        return self.__metric.get_coordinates(self)
+
     def append(self, colour: Colour):
         """Append a colour to the list"""
-        self.colours.append(colour)
+        if self.__size == len(self.__data):
+            # Grow geometrically so that appending is amortised constant time
+            data = np.empty((max(8, 2 * self.__size), 3), dtype=np.float64)
+            data[:self.__size] = self.values
+            self.__data = data
+        self.__data[self.__size] = colour.rgb
+        self.__size += 1
+        self.__lab = None
+        self.total_distance = None
 
     def clone(self):
-        colours = ColoursList()
-        for colour in self:
-            colours.append(colour.clone())
-        return colours
+        Instrumentation.count(Instrumentation.CLONES)
+        return ColoursList(self.values.copy(), None if self.__lab is None else self.__lab.copy(), self.__metric)
 
     def get(self, index: int):
         Assert.not_none(index)
-        return self.colours[index]
+        return Colour.from_array(self.values[index].copy())
 
-    def get_all(self) -> list:
-        return self.colours
+    def get_all(self) -> List[Colour]:
+        return list(self)
+
+    def get_distance_matrix(self, metric: Metric = None, directory: str = None) -> 'DistanceMatrix':
+        """
+        Get the matrix of the distances between every pair of colours in the list, shared through a
+        memory-mapped file with every other list holding the same colours in the same order.
+        :param metric: the distance, the metric of the list by default.
+        :param directory: where the matrix files are kept, DistanceMatrix.DEFAULT_DIRECTORY by default.
+        """
+        return DistanceMatrix.load(self, metric if metric is not None else self.__metric,
+                                   directory if directory is not None else DistanceMatrix.DEFAULT_DIRECTORY)
+
+    def get_distances_from(self, colour: Colour) -> np.ndarray:
+        """Get the euclidean distance between the given colour and every colour in the list."""
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, len(self))
+        return np.sqrt(np.sum((self.values - colour.rgb) ** 2, axis=1))
+
+    def get_nearest_neighbours(self, k: int, max_block_elements: int = 2 ** 22) -> np.ndarray:
+        """
+        Get the indexes of the k nearest colours of every colour in the list, excluding the colour itself.
+        The distances are computed in blocks of rows so that memory use stays bounded for large lists.
+        The CIEDE2000 differences are read from the distance matrix of the list.
+        :param k: the number of neighbours of each colour.
+        :param max_block_elements: the maximum number of distances held in memory at once.
+        :return: an N x k array of indexes, each row sorted by increasing distance.
+        """
+        size = len(self)
+        k = max(0, min(k, size - 1))
+        neighbours = np.empty((size, k), dtype=np.int32)
+        if k == 0:
+            return neighbours
+
+        if self.__metric.is_euclidean():
+            # The squared distances have the same order as the distances
+            coordinates = self.coordinates
+            Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, size * size)
+            squared_norms = np.sum(coordinates ** 2, axis=1)
+        else:
+            matrix = self.get_distance_matrix()
+        block_size = max(1, max_block_elements // size)
+        for start in range(0, size, block_size):
+            rows = np.arange(min(block_size, size - start))
+            if self.__metric.is_euclidean():
+                block = coordinates[start:start + block_size]
+                distances = squared_norms[start:start + block_size, np.newaxis] - 2 * block @ coordinates.T + \
+                    squared_norms
+            else:
+                distances = matrix.get_block(rows + start, np.arange(size))
+            distances[rows, rows + start] = inf
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            order = np.argsort(distances[rows[:, np.newaxis], nearest], axis=1)
+            neighbours[start:start + block_size] = nearest[rows[:, np.newaxis], order]
+        return neighbours
 
     def get_index(self, colour: Colour):
-        return self.colours.index(colour)
+        return self.index(colour)
 
     def get_random_element(self):
-        return random.choice(self.colours)
+        return self.get(random.randrange(len(self)))
+
+    def get_delta_e_from(self, colour: Colour) -> np.ndarray:
+        """Get the CIEDE2000 difference between the given colour and every colour in the list."""
+        return DeltaE.cie2000(colour.to_lab(), self.lab)
 
     def get_nearest_colour_delta_e(self, colour: Colour) -> (Colour, float):
-        total_distance = 0
-        min_distance = inf
-        nearest_colour = Colour(50, 50, 50)
-        for current_colour in self.colours:
-            current_distance = current_colour.to_delta_e(colour)
-            if current_distance < min_distance:
-                nearest_colour = current_colour
-                min_distance = current_distance
-                total_distance += min_distance
-        return nearest_colour, total_distance
+        distances = self.get_delta_e_from(colour)
+        index = int(np.argmin(distances))
+        return self.get(index), float(distances[index])
 
     def get_nearest_colour_euclidean(self, colour: Colour) -> (Colour, float):
-        total_distance = 0
-        min_distance = inf
-        nearest_colour = Colour(50, 50, 50)
-        for current_colour in self.colours:
-            current_distance = current_colour.distance_from(colour)
-            if current_distance < min_distance:
-                nearest_colour = current_colour
-                min_distance = current_distance
-                total_distance += min_distance
-        return nearest_colour, total_distance
+        distances = self.get_distances_from(colour)
+        index = int(np.argmin(distances))
+        return self.get(index), float(distances[index])
 
-    def get_total_distance(self) -> float:
-        if self.total_distance is not None:
-            return self.total_distance
+    def get_path_distance(self, order) -> float:
+        """Get the total distance of the path through the colours at the indexes in the given order."""
+        return self.__metric.get_total_distance(self.coordinates[np.asarray(order, dtype=np.intp)])
+
+    def get_path_distances(self, orders: np.ndarray) -> np.ndarray:
+        """Get the total distance of every path through the colours at the indexes in the rows of the orders."""
+        paths = self.coordinates[np.asarray(orders, dtype=np.intp)]
+        return np.sum(self.__metric.get_distances(paths[:, 1:], paths[:, :-1]), axis=1)
 
-        self.total_distance = 0
-        for i in range(len(self) - 1):
-            self.total_distance += self.get(i).distance_from(self.get(i + 1))
+    def get_total_distance(self) -> float:
+        if self.total_distance is None:
+            self.total_distance = self.__metric.get_total_distance(self.coordinates)
         return self.total_distance
 
-    def index(self, element):
-        return self.colours.index(element)
+    def index(self, element: Colour):
+        indexes = np.flatnonzero(self.__matches(element))
+        if len(indexes) == 0:
+            raise ValueError(f"{element} is not in list")
+        return int(indexes[0])
+
+    def permute(self, permutation) -> 'ColoursList':
+        """Return a new list containing the colours in the order given by the permutation of indexes."""
+        permutation = np.asarray(permutation, dtype=np.intp)
+        return ColoursList(self.values[permutation], None if self.__lab is None else self.__lab[permutation],
+                           self.__metric)
 
     def pop_random(self):
-        colour = random.choice(self.colours)
-        del self[colour]
+        index = random.randrange(len(self))
+        colour = self.get(index)
+        del self[index]
         return colour
 
-    def random_permutation(self, size) -> 'ColoursList':
-        new_list = ColoursList()
-        permutation = ColourUtils.get_permutation(size)
-        for i in range(size):
-            permutation_element = permutation[i]
-            colour = self.get(permutation_element)
-            new_list.append(colour)
-        return new_list
+    def random_permutation(self, size, generator: random.Random = None) -> 'ColoursList':
+        return self.permute(ColourUtils.get_permutation(size, generator))
+
+    def get_reverse_range_delta(self, start: int, end: int) -> float:
+        """
+        Get the change in total distance that reverse_range(start, end) would produce.
+        Only the two edges at the ends of the range change, so this runs in constant time.
+        :param start: the first index of the range (inclusive).
+        :param end: the last index of the range (exclusive).
+        """
+        coordinates = self.coordinates
+        if not self.__metric.is_euclidean():
+            # Score the edges that are created and removed in a single call of the kernel
+            firsts, seconds = [], []
+            if start > 0:
+                firsts += [start - 1, start - 1]
+                seconds += [end - 1, start]
+            if end < len(self):
+                firsts += [start, end - 1]
+                seconds += [end, end]
+            if not firsts:
+                return 0.0
+            distances = self.__metric.get_distances(coordinates[firsts], coordinates[seconds])
+            return float(np.sum(distances[0::2]) - np.sum(distances[1::2]))
+
+        delta = 0.0
+        if start > 0:
+            delta += self.__distance(coordinates[start - 1], coordinates[end - 1]) - \
+                     self.__distance(coordinates[start - 1], coordinates[start])
+        if end < len(self):
+            delta += self.__distance(coordinates[start], coordinates[end]) - \
+                     self.__distance(coordinates[end - 1], coordinates[end])
+        return delta
+
+    def reverse_range(self, start: int, end: int):
+        """Reverse in place the colours between start (inclusive) and end (exclusive)."""
+        if self.total_distance is not None:
+            self.total_distance += self.get_reverse_range_delta(start, end)
+        self.values[start:end] = self.values[start:end][::-1]
+        if self.__lab is not None:
+            self.__lab[start:end] = self.__lab[start:end][::-1]
 
     def slice(self, start_index: int = 0, end_index: int = None):
         """Return a slice of the list"""
-        return self.colours[start_index:end_index]
+        lab = None if self.__lab is None else self.__lab[start_index:end_index].copy()
+        return ColoursList(self.values[start_index:end_index].copy(), lab, self.__metric)
 
     def sort(self):
-        return np.sort(self.colours)
+        white = Colour.get_white()
+        return self.permute(np.argsort(self.get_distances_from(white), kind='stable'))
+
+
+class ColourGrid(object):
+    """
+    Nearest-neighbour index over a fixed array of colours, based on a uniform grid over the RGB cube.
+    Removed colours are marked as dead rather than moved, and the grid is rebuilt over the remaining
+    colours whenever most of them have been removed, so cells never become too sparse.
+    """
+
+    def __init__(self, values: np.ndarray, points_per_cell: float = 2):
+        """
+        :param values: the N x 3 array of colour coordinates. The index refers to colours by their row number.
+        :param points_per_cell: the average number of colours in each cell of the grid.
+        """
+        self.points_per_cell = points_per_cell
+        self.__values = values
+        self.__alive = np.ones(len(values), dtype=bool)
+        self.__alive_count = len(values)
+        self.__cell_ids = np.zeros(len(values), dtype=np.intp)
+        self.__build(np.arange(len(values)))
+
+    def __contains__(self, index: int):
+        return bool(self.__alive[index])
+
+    def __len__(self):
+        return self.__alive_count
+
+    # PRIVATE METHODS
+
+    def __build(self, indexes: np.ndarray):
+        points = self.__values[indexes]
+        size = max(1, int(round((len(indexes) / self.points_per_cell) ** (1 / 3))))
+        self.__low = points.min(axis=0) if len(points) > 0 else np.zeros(3)
+        extent = points.max(axis=0) - self.__low if len(points) > 0 else np.ones(3)
+        self.__cell_size = np.where(extent > 0, extent / size, 1.0)
+        self.__shape = (size, size, size)
+        self.__built_count = len(indexes)
+
+        cell_ids = np.ravel_multi_index(self.__get_cells(points).T, self.__shape)
+        order = np.argsort(cell_ids, kind='stable')
+        self.__cell_ids[indexes] = cell_ids
+        self.__indexes = indexes[order]
+        self.__cell_starts = np.searchsorted(cell_ids[order], np.arange(size ** 3 + 1))
+        self.__counts = np.bincount(cell_ids, minlength=size ** 3).reshape(self.__shape)
+
+    def __get_cells(self, points: np.ndarray) -> np.ndarray:
+        cells = np.floor((points - self.__low) / self.__cell_size).astype(np.intp)
+        return np.clip(cells, 0, self.__shape[0] - 1)
+
+    # PUBLIC METHODS
+
+    def nearest(self, rgb: np.ndarray) -> (int, float):
+        """
+        Find the colour in the index nearest to the given coordinates.
+        :param rgb: the red, green and blue coordinates to search from.
+        :return: the row number of the nearest colour and its euclidean distance from rgb.
+        """
+        Assert.not_empty(self, "The index is empty.")
+        size = self.__shape[0]
+        centre = self.__get_cells(rgb[np.newaxis])[0]
+        min_cell_size = self.__cell_size.min()
+        best_index, best_distance = -1, inf
+
+        # Visit the cells in shells of increasing Chebyshev radius around the cell containing rgb.
+        # Colours beyond shell r are at least r cells away, so the search stops once the best
+        # distance found is within that bound.
+        for radius in range(size):
+            low = np.maximum(centre - radius, 0)
+            high = np.minimum(centre + radius, size - 1) + 1
+            box = self.__counts[low[0]:high[0], low[1]:high[1], low[2]:high[2]]
+            cells = np.argwhere(box) + low
+            cells = cells[np.abs(cells - centre).max(axis=1) == radius]
+            if len(cells) > 0:
+                cell_ids = np.ravel_multi_index(cells.T, self.__shape)
+                candidates = np.concatenate(
+                    [self.__indexes[self.__cell_starts[i]:self.__cell_starts[i + 1]] for i in cell_ids])
+                candidates = candidates[self.__alive[candidates]]
+                Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, len(candidates))
+                distances = np.sum((self.__values[candidates] - rgb) ** 2, axis=1)
+                nearest = int(np.argmin(distances))
+                if distances[nearest] < best_distance:
+                    best_index, best_distance = int(candidates[nearest]), float(distances[nearest])
+
+            if best_index >= 0 and best_distance <= (radius * min_cell_size) ** 2:
+                break
+
+        return best_index, sqrt(best_distance)
+
+    def remove(self, index: int):
+        """Remove the colour at the given row number from the index."""
+        if not self.__alive[index]:
+            return
+        self.__alive[index] = False
+        self.__alive_count -= 1
+        self.__counts.flat[self.__cell_ids[index]] -= 1
+
+        if 0 < self.__alive_count < self.__built_count // 4:
+            self.__build(np.flatnonzero(self.__alive))
+
+
+class DeltaE:
+    """
+    Vectorised CIE Lab conversion and CIEDE2000 colour difference.
+    All the methods broadcast over the leading dimensions of their arguments, so the same call scores
+    one colour against one, one against many or, with an added axis, many against many.
+    """
+    # sRGB to XYZ matrix and D65 reference white for the 2 degrees standard observer
+    RGB_TO_XYZ = np.array([[0.412424, 0.357579, 0.180464],
+                           [0.212656, 0.715158, 0.0721856],
+                           [0.0193324, 0.119193, 0.950444]])
+    WHITE_POINT = np.array([0.95047, 1.0, 1.08883])
+    CIE_E = 216 / 24389
+
+    @staticmethod
+    def lab_from_rgb(rgb: np.ndarray) -> np.ndarray:
+        """
+        Convert sRGB coordinates in the range [0, 1] to CIE Lab.
+        :param rgb: an array of shape (..., 3).
+        :return: an array of the same shape holding the L, a and b coordinates.
+        """
+        rgb = np.asarray(rgb, dtype=np.float64)
+        linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+        xyz = (linear @ DeltaE.RGB_TO_XYZ.T) / DeltaE.WHITE_POINT
+        f = np.where(xyz > DeltaE.CIE_E, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+        return np.stack((116 * f[..., 1] - 16,
+                         500 * (f[..., 0] - f[..., 1]),
+                         200 * (f[..., 1] - f[..., 2])), axis=-1)
+
+    @staticmethod
+    def cie2000(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+        """
+        Calculate the CIEDE2000 difference between Lab colours.
+        :param lab1: an array of shape (..., 3).
+        :param lab2: an array of shape (..., 3) broadcastable against lab1.
+        :return: the broadcast array of differences.
+        """
+        lab1, lab2 = np.asarray(lab1, dtype=np.float64), np.asarray(lab2, dtype=np.float64)
+        l1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+        l2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+        avg_c7 = ((np.hypot(a1, b1) + np.hypot(a2, b2)) / 2) ** 7
+        g = 0.5 * (1 - np.sqrt(avg_c7 / (avg_c7 + 25.0 ** 7)))
+        a1p, a2p = (1 + g) * a1, (1 + g) * a2
+        c1p, c2p = np.hypot(a1p, b1), np.hypot(a2p, b2)
+        h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+        h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+        chroma_product = c1p * c2p
+
+        delta_lp = l2 - l1
+        delta_cp = c2p - c1p
+        delta_hp = h2p - h1p
+        delta_hp = np.where(delta_hp > 180, delta_hp - 360, np.where(delta_hp < -180, delta_hp + 360, delta_hp))
+        delta_hp = np.where(chroma_product == 0, 0, delta_hp)
+        delta_big_hp = 2 * np.sqrt(chroma_product) * np.sin(np.radians(delta_hp) / 2)
+
+        avg_lp = (l1 + l2) / 2
+        avg_cp = (c1p + c2p) / 2
+        avg_hp = h1p + h2p
+        avg_hp = np.where(np.abs(h1p - h2p) > 180, np.where(avg_hp < 360, avg_hp + 360, avg_hp - 360), avg_hp) / 2
+        avg_hp = np.where(chroma_product == 0, h1p + h2p, avg_hp)
+
+        t = 1 - 0.17 * np.cos(np.radians(avg_hp - 30)) + 0.24 * np.cos(np.radians(2 * avg_hp)) + \
+            0.32 * np.cos(np.radians(3 * avg_hp + 6)) - 0.2 * np.cos(np.radians(4 * avg_hp - 63))
+        delta_ro = 30 * np.exp(-(((avg_hp - 275) / 25) ** 2))
+        avg_cp7 = avg_cp ** 7
+        r_c = 2 * np.sqrt(avg_cp7 / (avg_cp7 + 25.0 ** 7))
+        s_l = 1 + (0.015 * (avg_lp - 50) ** 2) / np.sqrt(20 + (avg_lp - 50) ** 2)
+        s_c = 1 + 0.045 * avg_cp
+        s_h = 1 + 0.015 * avg_cp * t
+        r_t = -np.sin(np.radians(2 * delta_ro)) * r_c
+
+        delta_e = np.sqrt((delta_lp / s_l) ** 2 + (delta_cp / s_c) ** 2 + (delta_big_hp / s_h) ** 2 +
+                          r_t * (delta_cp / s_c) * (delta_big_hp / s_h))
+        Instrumentation.count(Instrumentation.DELTA_E_EVALUATIONS, np.size(delta_e))
+        return delta_e
+
+    @staticmethod
+    def cie2000_matrix(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+        """
+        Calculate the CIEDE2000 difference between every pair of colours of two lists.
+        :param lab1: an N x 3 array of Lab coordinates.
+        :param lab2: an M x 3 array of Lab coordinates.
+        :return: the N x M array of differences.
+        """
+        return DeltaE.cie2000(np.asarray(lab1)[:, np.newaxis, :], np.asarray(lab2)[np.newaxis, :, :])
+
+
+class DistanceMatrix(object):
+    """
+    The distances between every pair of colours of a palette, stored in the float32 condensed layout: the upper
+    triangle of the matrix, row by row, so the distance between the colours i < j is at index
+    i * N - i * (i + 1) / 2 + j - i - 1. The distances are computed in blocks of rows written straight to a
+    memory-mapped file named after the hash of the palette, so they are computed once and then shared without
+    copies by every algorithm and worker process that loads the same palette.
+    """
+
+    DEFAULT_DIRECTORY = "./results"
+    MAX_BLOCK_ELEMENTS = 2 ** 22  # the maximum number of distances held in memory while computing a matrix
+    MAX_LOADED = 16  # the number of matrices kept open by each process
+    MIN_FILE_SIZE = 1000  # smaller matrices are computed faster than they are written and mapped
+
+    __loaded = {}  # the condensed distances loaded by this process, by filename
+
+    def __init__(self, condensed: np.ndarray, size: int, metric: Metric):
+        """
+        :param condensed: the N * (N - 1) / 2 distances in the condensed layout.
+        :param size: the number N of colours.
+        :param metric: the metric the distances were computed with.
+        """
+        self.condensed = condensed
+        self.size = size
+        self.metric = metric
+
+    def __len__(self):
+        return self.size
+
+    # PRIVATE METHODS
+
+    @staticmethod
+    def __get_offset(row: int, size: int) -> int:
+        """Get the index of the distance between the colour at the row and the next one."""
+        return row * size - row * (row + 1) // 2
+
+    @staticmethod
+    def __get_block(colours: 'ColoursList', metric: Metric, start: int, end: int) -> np.ndarray:
+        """Get the distances between the colours from start to end and the colours from start onwards."""
+        coordinates = metric.get_coordinates(colours)
+        if not metric.is_euclidean():
+            return DeltaE.cie2000_matrix(coordinates[start:end], coordinates[start:])
+
+        Instrumentation.count(Instrumentation.DISTANCE_EVALUATIONS, (end - start) * (len(coordinates) - start))
+        differences = coordinates[start:end, np.newaxis, :] - coordinates[start:]
+        return np.sqrt(np.einsum('ijk,ijk->ij', differences, differences))
+
+    @staticmethod
+    def __write(colours: 'ColoursList', metric: Metric, filename: str):
+        # Write to a temporary file of this thread first, so that other threads and processes never map a partial
+        # matrix, and each of them replaces the file with a complete one
+        temporary = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            size = len(colours)
+            out = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float32, shape=(size * (size - 1) // 2,))
+            DistanceMatrix.compute(colours, metric, out)
+            out.flush()
+            del out
+            os.replace(temporary, filename)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    # PUBLIC METHODS
+
+    @staticmethod
+    def clear_cache():
+        """Forget the matrices loaded by this process, so that the next load maps or computes them again."""
+        DistanceMatrix.__loaded.clear()
+
+    @staticmethod
+    def get_filename(colours: 'ColoursList', metric: Metric, directory: str = DEFAULT_DIRECTORY) -> str:
+        palette_hash = hashlib.sha1(np.ascontiguousarray(colours.values).tobytes()).hexdigest()
+        return os.path.join(directory, f"distances_{metric.name.lower()}_{palette_hash}.npy")
+
+    @staticmethod
+    def compute(colours: 'ColoursList', metric: Metric = Metric.EUCLIDEAN, out: np.ndarray = None,
+                max_block_elements: int = MAX_BLOCK_ELEMENTS) -> np.ndarray:
+        """
+        Compute the condensed distances between the colours in blocks of rows.
+        :param out: the array of N * (N - 1) / 2 elements the distances are written to, e.g. a memory-mapped file.
+        If None, a new array is created.
+        :param max_block_elements: the maximum number of distances held in memory at once, besides out.
+        """
+        size = len(colours)
+        if out is None:
+            out = np.empty(size * (size - 1) // 2, dtype=np.float32)
+
+        block_size = max(1, max_block_elements // max(1, size))
+        for start in range(0, size, block_size):
+            end = min(start + block_size, size)
+            block = DistanceMatrix.__get_block(colours, metric, start, end)
+            for row in range(start, end):
+                offset = DistanceMatrix.__get_offset(row, size)
+                out[offset:offset + size - row - 1] = block[row - start, row - start + 1:]
+        return out
+
+    @staticmethod
+    def load(colours: 'ColoursList', metric: Metric = Metric.EUCLIDEAN,
+             directory: str = DEFAULT_DIRECTORY) -> 'DistanceMatrix':
+        """
+        Get the distance matrix of the colours, memory-mapping the file of their palette if it exists and
+        computing it otherwise. If the file cannot be written, e.g. because the directory does not exist,
+        or the palette has fewer than MIN_FILE_SIZE colours, the matrix is computed in memory.
+        """
+        size = len(colours)
+        filename = DistanceMatrix.get_filename(colours, metric, directory)
+        condensed = DistanceMatrix.__loaded.get(filename)
+        if condensed is None:
+            try:
+                if size < DistanceMatrix.MIN_FILE_SIZE:
+                    raise OSError("The matrix is too small to be kept in a file.")
+                if not os.path.exists(filename):
+                    DistanceMatrix.__write(colours, metric, filename)
+                condensed = np.load(filename, mmap_mode='r')
+            except OSError:
+                condensed = DistanceMatrix.compute(colours, metric)
+
+            if len(DistanceMatrix.__loaded) >= DistanceMatrix.MAX_LOADED:
+                DistanceMatrix.__loaded.pop(next(iter(DistanceMatrix.__loaded)))
+            DistanceMatrix.__loaded[filename] = condensed
+        return DistanceMatrix(condensed, size, metric)
+
+    def get(self, index1: int, index2: int) -> float:
+        if index1 == index2:
+            return 0.0
+        low, high = min(index1, index2), max(index1, index2)
+        return float(self.condensed[self.__get_offset(low, self.size) + high - low - 1])
+
+    def get_block(self, rows, columns) -> np.ndarray:
+        """
+        Get the distances between the colours at the rows indexes and the colours at the columns indexes.
+        :return: a len(rows) x len(columns) float64 array.
+        """
+        rows = np.asarray(rows, dtype=np.int64)[:, np.newaxis]
+        columns = np.asarray(columns, dtype=np.int64)[np.newaxis, :]
+        low, high = np.minimum(rows, columns), np.maximum(rows, columns)
+        diagonal = low == high
+        indexes = np.where(diagonal, 0, low * self.size - low * (low + 1) // 2 + high - low - 1)
+        block = self.condensed[indexes].astype(np.float64) if len(self.condensed) > 0 \
+            else np.zeros(indexes.shape, dtype=np.float64)
+        block[diagonal] = 0
+        return block
+
+    def get_dense(self, max_block_elements: int = MAX_BLOCK_ELEMENTS) -> np.ndarray:
+        """Get the N x N float32 matrix of the distances, expanded from the condensed layout in blocks of rows."""
+        columns = np.arange(self.size)
+        dense = np.empty((self.size, self.size), dtype=np.float32)
+        block_size = max(1, max_block_elements // max(1, self.size))
+        for start in range(0, self.size, block_size):
+            dense[start:start + block_size] = self.get_block(columns[start:start + block_size], columns)
+        return dense
+
+    def get_row(self, index: int, columns=None) -> np.ndarray:
+        """Get the distances between the colour at the index and the colours at the columns indexes, or all of them."""
+        return self.get_block([index], np.arange(self.size) if columns is None else columns)[0]
+
+    def get_reverse_delta(self, order: List[int], start: int, end: int) -> float:
+        """
+        Get the change in distance of the path through the colours in the given order that the reversal of its
+        positions from start to end (both included) would produce.
+        """
+        delta = 0.0
+        if start > 0:
+            delta += self.get(order[start - 1], order[end]) - self.get(order[start - 1], order[start])
+        if end < len(order) - 1:
+            delta += self.get(order[start], order[end + 1]) - self.get(order[end], order[end + 1])
+        return delta
 
 
 class ColourUtils:
@@ -199,24 +768,28 @@ class ColourUtils:
 
     @staticmethod
     def get_random_index(colours_list: list):
-        colour = random.choice(colours_list)
-        return colours_list.index(colour)
+        return random.randrange(len(colours_list))
 
     @staticmethod
-    def list_from_tuple_list(colours_list: list) -> ColoursList:
-        colours = ColoursList()
-        for element in colours_list:
-            colour = Colour(element[0], element[1], element[2])
-            colours.append(colour)
-        return colours
+    def list_from_tuple_list(colours_list: list or np.ndarray) -> ColoursList:
+        # Always copy, so that the list is writable even if the colours are memory-mapped
+        return ColoursList(np.array(colours_list, dtype=np.float64))
 
     @staticmethod
-    def get_total_distance(colours_list: list):
-        total = 0
-        for i in range(len(colours_list) - 1):
-            total += Colour.calculate_distance(colours_list[i], colours_list[i + 1])
-        return total
+    def get_total_distance(colours_list, metric: Metric = None) -> float:
+        """
+        Get the sum of the distances between consecutive colours.
+        :param colours_list: a ColoursList, a list of colours or an N x 3 array of coordinates of the metric.
+        :param metric: the distance, by default the metric of the ColoursList or the euclidean distance.
+        """
+        if isinstance(colours_list, np.ndarray):
+            return (metric if metric is not None else Metric.EUCLIDEAN).get_total_distance(colours_list)
+        if not isinstance(colours_list, ColoursList):
+            colours_list = ColoursList(np.array([colour.to_tuple() for colour in colours_list], dtype=np.float64))
+        metric = metric if metric is not None else colours_list.metric
+        return metric.get_total_distance(metric.get_coordinates(colours_list))
 
     @staticmethod
-    def get_permutation(size: int):
-        return random.sample(range(size), size)
+    def get_permutation(size: int, generator: random.Random = None):
+        """Get a random permutation of the first size indexes, drawn from the generator or the global one."""
+        return (random if generator is None else generator).sample(range(size), size)
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import sqlite3
+from typing import List
+
+import numpy as np
+
+from Algorithms import AlgorithmSolution
+from Colour import ColoursList
+from Utils import File
+
+
+class ResultStore(object):
+    """
+    SQLite store of the benchmark results, so that a sweep only runs the iterations it has not run before.
+    A run is identified by the algorithm, its parameters, the hash of the colours subset, the seed and the
+    version of the algorithms code. Every iteration is committed as soon as it completes, with the distances
+    of the solutions it saved and the best solution found so far, so an interrupted sweep resumes from
+    the last completed iteration.
+    """
+    DEFAULT_FILENAME = "./results/results.sqlite"
+    SOURCE_FILES = ["Algorithms.py", "Bound.py", "Colour.py"]  # the files whose changes invalidate the stored results
+    TIMEOUT = 60  # seconds to wait for another process writing to the store
+
+    __code_version = None
+
+    def __init__(self, filename: str = DEFAULT_FILENAME):
+        self.filename = filename
+        with self.__connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, algorithm TEXT, "
+                               "parameters TEXT, subset_hash TEXT, subset_size INTEGER, seed INTEGER, "
+                               "code_version TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS iterations (key TEXT, iteration INTEGER, run_time REAL, "
+                               "best_distance REAL, best_order BLOB, PRIMARY KEY (key, iteration))")
+            connection.execute("CREATE TABLE IF NOT EXISTS distances (key TEXT, iteration INTEGER, "
+                               "position INTEGER, distance REAL, PRIMARY KEY (key, iteration, position))")
+        connection.close()
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.filename, timeout=self.TIMEOUT)
+
+    @staticmethod
+    def get_code_version() -> str:
+        """Get the hash of the source files of the algorithms."""
+        if ResultStore.__code_version is None:
+            digest = hashlib.sha1()
+            for source_file in ResultStore.SOURCE_FILES:
+                with open(os.path.join(File.get_current_dir(), source_file), 'rb') as source:
+                    digest.update(source.read())
+            ResultStore.__code_version = digest.hexdigest()
+        return ResultStore.__code_version
+
+    @staticmethod
+    def describe(algorithm_name: str, parameters: list, colours: ColoursList, seed: int) -> dict:
+        """Get the description of a run, from which its key is computed."""
+        return {
+            "algorithm": algorithm_name,
+            "parameters": json.dumps(parameters),
+            "subset_hash": hashlib.sha1(np.ascontiguousarray(colours.values).tobytes()).hexdigest(),
+            "subset_size": len(colours),
+            "seed": seed,
+            "code_version": ResultStore.get_code_version(),
+        }
+
+    @staticmethod
+    def get_key(description: dict) -> str:
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def get_completed_iterations(self, key: str, iterations: int) -> int:
+        """Get the number of the first iterations of the run that are stored."""
+        with self.__connect() as connection:
+            completed, = connection.execute("SELECT COUNT(*) FROM iterations WHERE key = ? AND iteration < ?",
+                                            (key, iterations)).fetchone()
+        connection.close()
+        return completed
+
+    def save_iteration(self, description: dict, iteration: int, distances: List[float], run_time: float,
+                       best_solution: AlgorithmSolution):
+        """
+        Store a completed iteration of a run.
+        :param description: the description of the run, as returned by describe.
+        :param iteration: the index of the iteration.
+        :param distances: the distances of the solutions saved during the iteration.
+        :param run_time: the running time of the iteration in seconds.
+        :param best_solution: the best solution found by the run so far.
+        """
+        key = self.get_key(description)
+        with self.__connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO runs VALUES (:key, :algorithm, :parameters, :subset_hash, "
+                               ":subset_size, :seed, :code_version)", dict(description, key=key))
+            connection.executemany("INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?)",
+                                   [(key, iteration, position, float(distance))
+                                    for position, distance in enumerate(distances)])
+            connection.execute("INSERT OR REPLACE INTO iterations VALUES (?, ?, ?, ?, ?)",
+                               (key, iteration, run_time, float(best_solution.get_total_distance()),
+                                best_solution.get_order().astype(np.int32).tobytes()))
+        connection.close()
+
+    def load(self, key: str, iterations: int) -> (List[float], float, float, np.ndarray):
+        """
+        Load the first iterations of a run.
+        :return: the distances of the saved solutions, the total running time, and the distance and order of
+        the best solution.
+        """
+        with self.__connect() as connection:
+            distances = [distance for distance, in connection.execute(
+                "SELECT distance FROM distances WHERE key = ? AND iteration < ? ORDER BY iteration, position",
+                (key, iterations))]
+            run_time, = connection.execute("SELECT COALESCE(SUM(run_time), 0) FROM iterations "
+                                           "WHERE key = ? AND iteration < ?", (key, iterations)).fetchone()
+            best = connection.execute("SELECT best_distance, best_order FROM iterations "
+                                      "WHERE key = ? AND iteration < ? ORDER BY best_distance LIMIT 1",
+                                      (key, iterations)).fetchone()
+        connection.close()
+        if best is None:
+            return distances, run_time, None, None
+        return distances, run_time, best[0], np.frombuffer(best[1], dtype=np.int32)
@@ -1,10 +1,19 @@
+import os
+import random
 import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from enum import Enum
 from functools import total_ordering
 from typing import List
 
+import numpy as np
+
 from Algorithms import Algorithm, AlgorithmType, AlgorithmSolution
-from Colour import ColoursList, ColourUtils
-from Utils import Assert, Time, Plot
+from Bound import LowerBound
+from Colour import ColoursList, ColourUtils, Metric
+from ResultStore import ResultStore
+from Utils import Assert, ConvergenceLog, CProfileHook, Data, Instrumentation, Plot, Time
 
 
 class Benchmark(threading.Thread):
@@ -14,54 +23,237 @@ class Benchmark(threading.Thread):
     algorithm: Algorithm
     colours: ColoursList
 
-    def __init__(self, algorithm_type: AlgorithmType, colours: ColoursList, subset_size: int, iterations: int):
+    def __init__(self, algorithm_type: AlgorithmType, colours: ColoursList, subset_size: int, iterations: int,
+                 instrumented: bool = False, profile: bool = False, log: bool = False, store: ResultStore = None,
+                 metric: Metric = Metric.EUCLIDEAN, target_gap: float = None, generator: random.Random = None):
+        """
+        :param instrumented: whether to record the algorithm instrumentation counters.
+        :param profile: whether to profile the algorithm with cProfile, writing the statistics to ./results.
+        :param log: whether to stream the saved solutions to a convergence log in ./results while the algorithm
+        runs. The distances are then read back from the log instead of being kept in memory.
+        :param store: if not None, only the iterations that are not in the store yet are run, each one is stored
+        as soon as it completes, and the results are read back from the store.
+        :param metric: the metric the algorithm minimises the total distance with.
+        :param target_gap: if not None, every run of the algorithm stops as soon as its best solution is within
+        this gap of the lower bound, relative to the bound.
+        :param generator: the random generator the colours subset and the seed of the benchmark are drawn from.
+        If None, it is seeded from the global random generator.
+        """
         super().__init__()
+        generator = random.Random(random.getrandbits(64)) if generator is None else generator
         self.algorithm = Algorithm.factory(algorithm_type)  # the algorithm to run
+        self.algorithm.instrumentation.enabled = instrumented
+        self.algorithm.metric = metric
+        self.algorithm.target_gap = target_gap
         self.subset_size = subset_size
-        self.colours = colours.random_permutation(subset_size)  # the colours to use to run the benchmark
+        self.colours = colours.random_permutation(subset_size, generator)  # the colours to run the benchmark on
+        self.colours.metric = metric
         self.test_results = []  # the results for each run
         self.iterations = iterations  # number of times to run
+        self.seed = generator.getrandbits(32)  # the seed the algorithm is reseeded with before running
+
+        name = f"{self.algorithm.get_algorithm_name()}_{subset_size}_{iterations}"
+        if profile:
+            self.algorithm.profiler = CProfileHook(f"./results/{name}.prof")
+        if log:
+            self.algorithm.convergence_log = ConvergenceLog(f"./results/{name}.jsonl", f"{name}_{uuid.uuid4().hex}", {
+                "algorithm": self.algorithm.get_algorithm_name(),
+                "subset_size": subset_size,
+                "iterations": iterations,
+                "metric": metric.name,
+                "target_gap": target_gap,
+            })
+
+        self.store = store
+        self.run_description = None
+        self.completed_iterations = 0  # the number of iterations already in the store
+        self.__stored_solution = None
+        self.__stored_run_time = None
+        if store is not None:
+            self.run_description = ResultStore.describe(self.algorithm.get_algorithm_name(), [metric.name, target_gap],
+                                                        self.colours, self.seed)
+            self.completed_iterations = store.get_completed_iterations(ResultStore.get_key(self.run_description),
+                                                                       iterations)
+
+    def is_complete(self) -> bool:
+        """Check whether all the iterations of the benchmark are already in the store."""
+        return self.store is not None and self.completed_iterations >= self.iterations
+
+    def get_best_solution(self) -> AlgorithmSolution:
+        if self.__stored_solution is not None:
+            return self.__stored_solution
+        return self.algorithm.get_best_solution()
 
     def get_distances(self):
+        log = self.algorithm.convergence_log
+        if self.store is None and log is not None:
+            _, distances = ConvergenceLog.get_run(log.filename, log.run_id)
+            Assert.not_empty(distances, "No results to generate statistics for.")
+            return distances.tolist()
+
         Assert.not_empty(self.test_results, "No results to generate statistics for.")
         return [result.get_distance() for result in self.test_results]
 
+    def get_lower_bound(self) -> float or None:
+        """
+        Get the 1-tree lower bound of the total distance of the colours of the benchmark, or None if no target gap
+        was requested, since it is costly to compute for large subsets.
+        """
+        if self.algorithm.target_gap is None:
+            return None
+        if self.algorithm.lower_bound is not None:
+            return self.algorithm.lower_bound
+        return LowerBound.get_lower_bound(self.colours, self.get_best_solution().get_total_distance())
+
+    def get_gap(self) -> float or None:
+        """Get the gap between the best solution and the lower bound, relative to the bound, if it is computed."""
+        lower_bound = self.get_lower_bound()
+        if lower_bound is None:
+            return None
+        return LowerBound.get_gap(self.get_best_solution().get_total_distance(), lower_bound)
+
     def get_total_time(self):
+        if self.__stored_run_time is not None:
+            return self.__stored_run_time
         return self.algorithm.get_run_time()
 
+    def get_report(self) -> dict:
+        """Get the statistics of the distances, the running time and the instrumentation of the benchmark."""
+        mean, median, std = Data.get_statistics(self.get_distances())
+        report = {
+            "algorithm": self.algorithm.get_algorithm_name(),
+            "subset_size": self.subset_size,
+            "iterations": self.iterations,
+            "metric": self.algorithm.metric.name,
+            "run_time": self.get_total_time(),
+            "mean": float(mean),
+            "median": float(median),
+            "std": float(std),
+            "lower_bound": self.get_lower_bound(),  # None if no target gap was requested
+            "gap": self.get_gap(),
+        }
+        report.update(self.algorithm.instrumentation.to_dict())
+        return report
+
     def __save_results(self):
-        for solution in self.algorithm.get_solutions():
-            self.test_results.append(TestResult.from_solution(solution))
+        if self.store is not None:
+            self.load_stored_results()
+            return
+        if self.algorithm.convergence_log is not None:
+            # The results are already in the convergence log
+            return
+        for _, distance in self.algorithm.get_trace():
+            self.test_results.append(TestResult.from_distance(self.subset_size, distance))
+
+    @staticmethod
+    def run_algorithm(algorithm: Algorithm, colours: ColoursList, iterations: int, seed: int = None) -> Algorithm:
+        """
+        Run the algorithm on the colours and return it together with its solutions and running time.
+        This is executed by the worker processes, so it must only use its arguments.
+        :param seed: if not None, the algorithm is reseeded before running. Its own generators are used rather
+        than the global one, so that benchmarks running in threads do not interfere with each other.
+        """
+        if seed is not None:
+            algorithm.reseed(seed)
+        algorithm.load_colours_list(colours)
+        algorithm.run(iterations)
+        return algorithm
+
+    @staticmethod
+    def get_iteration_seed(seed: int, iteration: int) -> int:
+        """Get the seed of an iteration of a stored run, independent from the iteration the run is resumed from."""
+        return int(np.random.SeedSequence(seed, spawn_key=(iteration,)).generate_state(1, np.uint64)[0])
+
+    @staticmethod
+    def run_stored_algorithm(algorithm: Algorithm, colours: ColoursList, iterations: int, seed: int,
+                             store: ResultStore, run_description: dict, first_iteration: int) -> Algorithm:
+        """
+        Run the iterations of the algorithm from the first one that is not in the store, storing each of them as
+        soon as it completes. This is executed by the worker processes, so it must only use its arguments.
+        Every iteration runs on a fresh copy of the colours, which resets the state the algorithm derived from
+        them, and with a seed derived from its index, so that it gives the same results whether the run is resumed
+        or not: a stateful algorithm such as hill climbing starts every iteration again from the loaded colours.
+        :param seed: the seed from which the seed of every iteration is derived.
+        """
+        for iteration in range(first_iteration, iterations):
+            algorithm.load_colours_list(colours)
+            algorithm.reseed(Benchmark.get_iteration_seed(seed, iteration))
+            saved_solutions = len(algorithm.trace)
+            algorithm.run(1)
+            store.save_iteration(run_description, iteration,
+                                 [distance for _, distance in algorithm.trace[saved_solutions:]],
+                                 algorithm.get_run_time(), algorithm.get_best_solution())
+        return algorithm
+
+    def load_stored_results(self):
+        """Load the results, the best solution and the running time of the benchmark from the store."""
+        distances, self.__stored_run_time, best_distance, best_order = self.store.load(
+            ResultStore.get_key(self.run_description), self.iterations)
+        self.test_results = [TestResult.from_distance(self.subset_size, distance) for distance in distances]
+        self.__stored_solution = AlgorithmSolution(self.colours, best_distance, best_order)
 
     def run(self):
-        self.algorithm.load_colours_list(self.colours)
-        self.algorithm.run(self.iterations)
+        if self.store is not None:
+            self.algorithm = self.run_stored_algorithm(self.algorithm, self.colours, self.iterations, self.seed,
+                                                       self.store, self.run_description, self.completed_iterations)
+        else:
+            self.algorithm = self.run_algorithm(self.algorithm, self.colours, self.iterations, self.seed)
         self.__save_results()
 
-    def plot_colours(self):
-        Plot.colours(
-            self.algorithm.get_best_solution().get_colours(),
-            self.algorithm.get_best_solution().get_total_distance(),
+    def submit(self, executor: ProcessPoolExecutor) -> Future:
+        """Run the benchmark on the executor. The future result must be passed to collect()."""
+        if self.store is not None:
+            return executor.submit(Benchmark.run_stored_algorithm, self.algorithm, self.colours, self.iterations,
+                                   self.seed, self.store, self.run_description, self.completed_iterations)
+        return executor.submit(Benchmark.run_algorithm, self.algorithm, self.colours, self.iterations, self.seed)
+
+    def collect(self, algorithm: Algorithm):
+        """Store the algorithm returned by a worker process and its results."""
+        self.algorithm = algorithm
+        self.__save_results()
+
+    def get_colours_plot(self, lightweight: bool = False) -> tuple:
+        """
+        :param lightweight: whether to save a plain colour strip with the PNG encoder instead of a matplotlib figure.
+        """
+        colours = self.get_best_solution().get_colours().values
+        if lightweight:
+            return "colour_strip", (colours, self.algorithm.get_algorithm_name())
+
+        return "colours", (
+            colours,
+            self.get_best_solution().get_total_distance(),
             self.algorithm.get_algorithm_name(),
-            self.algorithm.get_run_time()
+            self.get_total_time(),
+            self.algorithm.metric.name.lower()
         )
 
-    def plot_distance_distribution(self):
-        Plot.candlestick_distances(
+    def get_distance_distribution_plot(self) -> tuple:
+        return "candlestick_distances", (
             self.algorithm.get_algorithm_name(),
             self.get_distances(),
             self.subset_size,
-            self.iterations
+            self.iterations,
+            self.get_gap()
         )
 
-    def plot_distance_progress(self):
-        Plot.scatter_distances(
+    def get_distance_progress_plot(self) -> tuple:
+        return "scatter_distances", (
             self.algorithm.get_algorithm_name(),
             self.get_distances(),
             self.subset_size,
             self.iterations
         )
 
+    def plot_colours(self):
+        Plot.render([self.get_colours_plot()])
+
+    def plot_distance_distribution(self):
+        Plot.render([self.get_distance_distribution_plot()])
+
+    def plot_distance_progress(self):
+        Plot.render([self.get_distance_progress_plot()])
+
 
 @total_ordering
 class TestResult(object):
@@ -78,9 +270,13 @@ class TestResult(object):
 
     @staticmethod
     def from_solution(solution: AlgorithmSolution):
+        return TestResult.from_distance(len(solution), solution.get_total_distance())
+
+    @staticmethod
+    def from_distance(subset_size: int, total_distance: float):
         tr = TestResult()
-        tr.subset_size = len(solution.get_colours())
-        tr.total_distance = solution.get_total_distance()
+        tr.subset_size = subset_size
+        tr.total_distance = total_distance
         return tr
 
     def get_distance(self):
@@ -94,17 +290,50 @@ class TestRunConfiguration(object):
         self.iterations = iterations
 
 
+class ExecutionMode(Enum):
+    THREAD = 0,
+    PROCESS = 1
+
+
 class TestRunner(object):
     """
     TestRunner handles the benchmarking process for the chosen algorithms.
     It creates a new Benchmark for each test to be run, and runs each one
-    of them using a separate thread.
+    of them using a separate thread or, in process mode, a pool of worker processes.
     """
     benchmarks: List[Benchmark]
     run_configurations: List[TestRunConfiguration]
 
-    def __init__(self, colours: list):
+    def __init__(self, colours: list or np.ndarray, execution_mode: ExecutionMode = ExecutionMode.THREAD,
+                 workers: int = None, instrumented: bool = False, profile: bool = False, log: bool = False,
+                 store: ResultStore = None, seed: int = None, metric: Metric = Metric.EUCLIDEAN,
+                 target_gap: float = None):
+        """
+        :param colours: the list of colours as (red, green, blue) tuples, or an N x 3 array.
+        :param execution_mode: whether to run the benchmarks in threads or in worker processes.
+        :param workers: the number of worker processes; defaults to the number of CPUs.
+        :param instrumented: whether to record the algorithms instrumentation counters.
+        :param profile: whether to profile every benchmark with cProfile. Profilers cannot always run in
+        several threads at once, so this is best combined with ExecutionMode.PROCESS.
+        :param log: whether every benchmark streams its solutions to a convergence log in ./results.
+        :param store: if not None, the benchmarks whose iterations are all in the store are not run again,
+        the partly completed ones are resumed, and the statistics and plots are produced from the stored results.
+        :param seed: the seed from which the colours subset and the seed of every benchmark are derived.
+        With a store, it defaults to 0, so that the same configurations are found again on the next run.
+        :param metric: the metric every algorithm minimises the total distance with.
+        :param target_gap: if not None, every run stops as soon as its best solution is within this gap of the
+        lower bound of its colours, relative to the bound.
+        """
         self.colours = ColourUtils.list_from_tuple_list(colours)
+        self.execution_mode = execution_mode
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.instrumented = instrumented
+        self.profile = profile
+        self.log = log
+        self.store = store
+        self.seed = seed if seed is not None or store is None else 0
+        self.metric = metric
+        self.target_gap = target_gap
         self.run_configurations = []
         self.threads = []
         self.benchmarks = []
@@ -121,29 +350,68 @@ class TestRunner(object):
         self.run_configurations.append(trc)
         self.algorithms.add(algorithm_type)
 
+    def __get_configuration_seed(self, test_run: TestRunConfiguration) -> int:
+        """Get the seed of a configuration, independent from the other configurations and its iterations."""
+        spawn_key = (list(AlgorithmType).index(test_run.algorithm_type), test_run.subset_size)
+        return int(np.random.SeedSequence(self.seed, spawn_key=spawn_key).generate_state(1, np.uint64)[0])
+
     def configure(self):
         for test_run in self.run_configurations:
-            benchmark = Benchmark(test_run.algorithm_type, self.colours, test_run.subset_size, test_run.iterations)
+            # Each benchmark draws from its own generator, so that the global one is left untouched
+            generator = random.Random(self.__get_configuration_seed(test_run)) if self.seed is not None else None
+            benchmark = Benchmark(test_run.algorithm_type, self.colours, test_run.subset_size, test_run.iterations,
+                                  self.instrumented, self.profile, self.log, self.store, self.metric,
+                                  self.target_gap, generator)
             self.benchmarks.append(benchmark)
 
-    def __plot_benchmarks(self):
-        print("Plotting results...")
-
+    def __get_benchmark_plots(self, lightweight: bool = False) -> List[tuple]:
+        plots = []
         starting_subsets = []
         for benchmark in self.benchmarks:
             if benchmark.subset_size not in starting_subsets:
                 # Plot the starting colours once for each colour subset
                 starting_subsets.append(len(benchmark.colours))
-                Plot.colours(
-                    benchmark.colours.get_all(),
-                    benchmark.colours.get_total_distance()
-                )
+                if lightweight:
+                    plots.append(("colour_strip", (benchmark.colours.values,)))
+                else:
+                    plots.append(("colours", (benchmark.colours.values, benchmark.colours.get_total_distance(), None,
+                                              None, benchmark.colours.metric.name.lower())))
+
+            plots.append(benchmark.get_colours_plot(lightweight))
+        return plots
+
+    def __get_distance_plots(self) -> List[tuple]:
+        plots = []
+        for benchmark in self.benchmarks:
+            plots.append(benchmark.get_distance_distribution_plot())
+            plots.append(benchmark.get_distance_progress_plot())
+        return plots
 
-            benchmark.plot_colours()
+    def get_plots(self, lightweight: bool = False) -> List[tuple]:
+        """
+        Get every plot of the results as plain data, in the format accepted by Plot.render.
+        :param lightweight: whether to save the colours as plain strips with the PNG encoder, and skip the
+        distance plots, so that matplotlib is not needed at all.
+        """
+        if lightweight:
+            return self.__get_benchmark_plots(lightweight)
+        return self.__get_benchmark_plots() + self.__get_distance_plots()
 
-    def plot_all(self):
-        self.__plot_benchmarks()
-        self.plot_distances()
+    def plot_all(self, separate_process: bool = False, lightweight: bool = False):
+        """
+        Plot all the results.
+        :param separate_process: whether to render the plots in a separate process, so that matplotlib is never
+        imported by this one.
+        :param lightweight: see get_plots.
+        """
+        print("Plotting results...")
+        plots = self.get_plots(lightweight)
+        if not separate_process:
+            Plot.render(plots)
+            return
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            executor.submit(Plot.render, plots).result()
     # def plot_run_times(self):
     #
     #     data = {}
@@ -167,10 +435,47 @@ class TestRunner(object):
     #     for algorithms, iterations, times in graphics_values:
     #         Plot.barchart(algorithms, times, iterations)
 
+    @staticmethod
+    def __print_start(benchmark: Benchmark):
+        if benchmark.completed_iterations > 0:
+            print(f"Resuming benchmark for {benchmark.algorithm.get_algorithm_name()} "
+                  f"from iteration {benchmark.completed_iterations}")
+        else:
+            print(f"Starting benchmark for {benchmark.algorithm.get_algorithm_name()}")
+
+    @staticmethod
+    def __start_processes(benchmarks: List[Benchmark], workers: int):
+        # Distribute the benchmarks over the worker processes
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for benchmark in benchmarks:
+                TestRunner.__print_start(benchmark)
+                futures.append(benchmark.submit(executor))
+
+            # Wait for all the processes to return their results
+            for benchmark, future in zip(benchmarks, futures):
+                benchmark.collect(future.result())
+
     def __start_benchmarks(self):
-        # Start all the benchmarks in parallel
+        # The benchmarks whose iterations have all been stored by a previous run are not run again
+        benchmarks = []
         for benchmark in self.benchmarks:
-            print(f"Starting benchmark for {benchmark.algorithm.get_algorithm_name()}")
+            if benchmark.is_complete():
+                print(f"Loading stored results for {benchmark.algorithm.get_algorithm_name()}")
+                benchmark.load_stored_results()
+            else:
+                benchmarks.append(benchmark)
+
+        if not benchmarks:
+            return
+
+        if self.execution_mode == ExecutionMode.PROCESS:
+            self.__start_processes(benchmarks, self.workers)
+            return
+
+        # Start all the benchmarks in parallel
+        for benchmark in benchmarks:
+            TestRunner.__print_start(benchmark)
             benchmark.start()
             self.threads.append(benchmark)
 
@@ -184,16 +489,37 @@ class TestRunner(object):
         """
         Assert.not_empty(self.benchmarks, "The benchmarks list cannot be empty. Please add run configurations.")
 
-        timestamp_start = Time.get_timestamp_millis()
+        timestamp_start = Time.get_timestamp_nanos()
         self.__start_benchmarks()
-        timestamp_end = Time.get_timestamp_millis()
-        running_time = Time.millis_to_seconds(timestamp_end, timestamp_start)
-        print(f"All threads finished in {running_time} s")
+        timestamp_end = Time.get_timestamp_nanos()
+        running_time = Time.nanos_to_seconds(timestamp_end, timestamp_start)
+        print(f"All benchmarks finished in {running_time:.3f} s")
 
     def get_benchmarks(self):
         return self.benchmarks
 
-    def plot_distances(self):
+    def get_report(self) -> dict:
+        """Get the report of every benchmark and the instrumentation counters summed over all of them."""
+        total = Instrumentation()
         for benchmark in self.benchmarks:
-            benchmark.plot_distance_distribution()
-            benchmark.plot_distance_progress()
+            total.merge(benchmark.algorithm.instrumentation.counters, benchmark.algorithm.instrumentation.phase_times)
+        return {
+            "benchmarks": [benchmark.get_report() for benchmark in self.benchmarks],
+            "total": total.to_dict(),
+        }
+
+    def print_report(self):
+        report = self.get_report()
+        for benchmark in report["benchmarks"]:
+            print(f"{benchmark['algorithm']} ({benchmark['subset_size']} colours, "
+                  f"{benchmark['iterations']} iterations): "
+                  f"mean {benchmark['mean']:.2f}, median {benchmark['median']:.2f}, std {benchmark['std']:.2f}, "
+                  + (f"gap {benchmark['gap']:.2%}, " if benchmark['gap'] is not None else "")
+                  + f"run time {benchmark['run_time']:.3f} s")
+            for name, value in benchmark["counters"].items():
+                print(f"    {name}: {value}")
+            for name, seconds in benchmark["phase_times"].items():
+                print(f"    {name} time: {seconds:.3f} s")
+
+    def plot_distances(self):
+        Plot.render(self.__get_distance_plots())
@@ -1,10 +1,18 @@
+import cProfile
+import glob
+import json
 import os
+import struct
+import threading
 import time
-from typing import List
+import zlib
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, List
 
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.figure import Figure
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
 
 
 class Assert:
@@ -26,6 +34,22 @@ class Time:
     def get_timestamp_millis():
         return int(round(time.time() * 1000))
 
+    @staticmethod
+    def get_timestamp_nanos() -> int:
+        """Get the value of the highest resolution monotonic clock in nanoseconds."""
+        return time.perf_counter_ns()
+
+    @staticmethod
+    def nanos_to_seconds(time1, time2) -> float:
+        if time1 < time2:
+            time1, time2 = time2, time1
+        return (time1 - time2) / 1e9
+
+    @staticmethod
+    def get_monotonic_seconds() -> float:
+        """Get the value of a monotonic clock, only meaningful to measure intervals."""
+        return time.perf_counter()
+
     @staticmethod
     def millis_to_seconds(time1, time2):
         if time1 < time2:
@@ -33,6 +57,236 @@ class Time:
         return (time1 - time2) / 1000
 
 
+class Instrumentation(object):
+    """
+    Counters of the work done by an algorithm and the time spent in each of its phases.
+    Kernels report their work with Instrumentation.count, which only records it if an enabled
+    instrumentation has been activated in the current thread, so the counters cost a lookup when disabled.
+    Hot loops should add their counts in bulk once they finish.
+    """
+    DISTANCE_EVALUATIONS = "distance_evaluations"
+    DELTA_E_EVALUATIONS = "delta_e_evaluations"
+    CLONES = "clones"
+    MOVES_PROPOSED = "moves_proposed"
+    MOVES_ACCEPTED = "moves_accepted"
+    MOVES_REJECTED = "moves_rejected"
+
+    __active = threading.local()
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters = {}
+        self.phase_times = {}  # nanoseconds spent in each phase
+
+    @staticmethod
+    def current() -> 'Instrumentation':
+        """Get the instrumentation active in the current thread, or None."""
+        return getattr(Instrumentation.__active, "instrumentation", None)
+
+    @staticmethod
+    def count(name: str, amount: int = 1):
+        """Add to a counter of the instrumentation active in the current thread, if any."""
+        instrumentation = getattr(Instrumentation.__active, "instrumentation", None)
+        if instrumentation is not None:
+            instrumentation.counters[name] = instrumentation.counters.get(name, 0) + amount
+
+    @staticmethod
+    def phase(name: str):
+        """Time the code run inside the returned context manager as the given phase."""
+        instrumentation = getattr(Instrumentation.__active, "instrumentation", None)
+        return nullcontext() if instrumentation is None else instrumentation.__time_phase(name)
+
+    @contextmanager
+    def __time_phase(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.phase_times[name] = self.phase_times.get(name, 0) + time.perf_counter_ns() - start
+
+    @contextmanager
+    def activate(self):
+        """Make this instrumentation the one counting in the current thread, if it is enabled."""
+        if not self.enabled:
+            yield
+            return
+        previous = Instrumentation.current()
+        Instrumentation.__active.instrumentation = self
+        try:
+            yield
+        finally:
+            Instrumentation.__active.instrumentation = previous
+
+    def merge(self, counters: dict, phase_times: dict = None):
+        """Add the counters and phase times of another instrumentation, e.g. one from a worker process."""
+        for name, amount in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + amount
+        for name, nanos in (phase_times or {}).items():
+            self.phase_times[name] = self.phase_times.get(name, 0) + nanos
+
+    def to_dict(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "phase_times": {name: nanos / 1e9 for name, nanos in self.phase_times.items()},
+        }
+
+
+class CProfileHook(object):
+    """
+    Profile the code run inside the hook with cProfile and write the statistics to a file.
+    Any other context manager, e.g. one starting and stopping a sampling profiler, can be used in its place.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.__profile = None
+
+    def __enter__(self):
+        self.__profile = cProfile.Profile()
+        self.__profile.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.__profile.disable()
+        self.__profile.dump_stats(self.filename)
+        self.__profile = None
+
+
+class ConvergenceLog(object):
+    """
+    Append-only JSON lines log of the solutions saved by an algorithm, written while it runs.
+    The first record of every run holds its metadata, the following ones the iteration and total distance of
+    each saved solution, and optionally its permutation. Records are written in batches and the file is
+    fsync'd periodically, so a crash loses at most the last batch. A truncated last line is skipped when reading.
+    Like CProfileHook, the file is only opened when the log is entered, so the log can be sent to a worker process.
+    """
+    BATCH_SIZE = 100
+    FSYNC_INTERVAL = 5  # seconds
+
+    def __init__(self, filename: str, run_id: str, metadata: dict = None, save_orders: bool = False,
+                 batch_size: int = BATCH_SIZE, fsync_interval: float = FSYNC_INTERVAL):
+        """
+        :param filename: the log file, appended to if it already exists.
+        :param run_id: the identifier of the run, written in every record.
+        :param metadata: written in the first record of the run, e.g. the algorithm name and the subset size.
+        :param save_orders: whether to write the permutation of every solution.
+        :param batch_size: the number of records buffered before they are written.
+        :param fsync_interval: the minimum number of seconds between two fsync calls.
+        """
+        self.filename = filename
+        self.run_id = run_id
+        self.metadata = metadata or {}
+        self.save_orders = save_orders
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.__file = None
+        self.__buffer = []
+        self.__last_fsync = 0
+        self.__lock = None
+
+    def __enter__(self):
+        self.__file = open(self.filename, 'a')
+        self.__lock = threading.Lock()
+        if not self.__ends_with_newline():
+            # Terminate the truncated record of a crashed run, so that it does not swallow the next one
+            self.__file.write('\n')
+        self.__last_fsync = Time.get_monotonic_seconds()
+        self.__write_record(dict(self.metadata, run=self.run_id))
+        return self
+
+    def __exit__(self, *args):
+        self.flush(fsync=True)
+        self.__file.close()
+        self.__file = None
+        self.__lock = None
+
+    def __ends_with_newline(self) -> bool:
+        if os.path.getsize(self.filename) == 0:
+            return True
+        with open(self.filename, 'rb') as log:
+            log.seek(-1, os.SEEK_END)
+            return log.read(1) == b'\n'
+
+    def __write_record(self, record: dict):
+        with self.__lock:
+            self.__buffer.append(json.dumps(record, separators=(',', ':')))
+            if len(self.__buffer) >= self.batch_size:
+                self.__write_buffer()
+
+    def __write_buffer(self, fsync: bool = False):
+        if self.__buffer:
+            self.__file.write('\n'.join(self.__buffer) + '\n')
+            self.__buffer = []
+        self.__file.flush()
+        if fsync or Time.get_monotonic_seconds() - self.__last_fsync >= self.fsync_interval:
+            os.fsync(self.__file.fileno())
+            self.__last_fsync = Time.get_monotonic_seconds()
+
+    def append(self, iteration: int, distance: float, order: np.ndarray = None):
+        """Log a solution. Its order is only written if save_orders is set."""
+        record = {"run": self.run_id, "iteration": int(iteration), "distance": float(distance)}
+        if self.save_orders and order is not None:
+            record["order"] = np.asarray(order).tolist()
+        self.__write_record(record)
+
+    def flush(self, fsync: bool = False):
+        """Write the buffered records."""
+        with self.__lock:
+            self.__write_buffer(fsync)
+
+    @staticmethod
+    def read(filename: str, run_id: str = None):
+        """
+        Iterate over the records of the log, one line at a time, skipping a truncated last line.
+        :param run_id: if not None, only the records of this run are parsed and returned.
+        """
+        with open(filename) as log:
+            for line in log:
+                # Lines that cannot belong to the run are skipped before they are parsed
+                if run_id is not None and run_id not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if run_id is None or record.get("run") == run_id:
+                    yield record
+
+    @staticmethod
+    def get_run(filename: str, run_id: str) -> (dict, np.ndarray):
+        """
+        Rebuild the progress of one run of the log, reading only its own records while streaming the file.
+        :return: the metadata of the run and the array of its logged distances, in order.
+        """
+        metadata = {}
+        distances = []
+        for record in ConvergenceLog.read(filename, run_id):
+            record.pop("run")
+            if "distance" not in record:
+                metadata = record
+            else:
+                distances.append(record["distance"])
+        return metadata, np.array(distances, dtype=np.float64)
+
+    @staticmethod
+    def get_runs(filename: str) -> dict:
+        """
+        Rebuild the progress of every run in the log without keeping the solutions in memory.
+        :return: a dict from every run id to its metadata and the array of its logged distances, in order.
+        """
+        metadata = {}
+        distances = {}
+        for record in ConvergenceLog.read(filename):
+            run_id = record.pop("run")
+            if "distance" not in record:
+                metadata[run_id] = record
+                distances.setdefault(run_id, [])
+            else:
+                distances.setdefault(run_id, []).append(record["distance"])
+        return {run_id: (metadata.get(run_id, {}), np.array(run_distances, dtype=np.float64))
+                for run_id, run_distances in distances.items()}
+
+
 class File:
     @staticmethod
     def get_current_dir():
@@ -57,10 +311,88 @@ class File:
             colours.append(rgb)
         return n, colours
 
+    @staticmethod
+    def __parse_colours(fname) -> np.ndarray:
+        """Parse a file in the colours.txt format straight into an N x 3 float64 array."""
+        header_lines = 0
+        with open(fname, 'r') as afile:
+            for line in afile:
+                header_lines += 1
+                if line.strip() and not line.lstrip().startswith('#'):
+                    n = int(line)  # number of colours in the file
+                    break
+            else:
+                raise ValueError(f"{fname} does not contain the number of colours.")
+        return np.loadtxt(fname, dtype=np.float64, skiprows=header_lines, max_rows=n, ndmin=2).reshape(-1, 3)
+
+    @staticmethod
+    def get_cache_filename(fname) -> str:
+        """Get the name of the binary cache of a colours file, keyed by the file size and modification time."""
+        stat = os.stat(fname)
+        return f"{fname}.{stat.st_size}.{stat.st_mtime_ns}.npy"
+
+    @staticmethod
+    def load_colours(fname, cache: bool = True) -> np.ndarray:
+        """
+        Load the colours of a file in the colours.txt format as an N x 3 float64 array.
+        The parsed colours are saved in a .npy file next to the colours file, which later calls
+        memory-map instead of parsing the text again. The cache is rebuilt when the file size or
+        modification time change.
+        :param fname: the name of the colours file.
+        :param cache: whether to read and write the binary cache.
+        :return: the colours array; read-only when it is memory-mapped from the cache.
+        """
+        if not cache:
+            return File.__parse_colours(fname)
+
+        cache_filename = File.get_cache_filename(fname)
+        if os.path.exists(cache_filename):
+            return np.load(cache_filename, mmap_mode='r')
+
+        colours = File.__parse_colours(fname)
+        try:
+            # Remove the caches of previous versions of the file, then write the new one atomically
+            for stale in glob.glob(f"{glob.escape(fname)}.*.*.npy"):
+                os.remove(stale)
+            temporary_filename = f"{cache_filename}.{os.getpid()}.tmp"
+            with open(temporary_filename, 'wb') as cache_file:
+                np.save(cache_file, colours)
+            os.replace(temporary_filename, cache_filename)
+        except OSError:
+            # The cache is only an optimisation; the parsed colours are still valid
+            return colours
+        return np.load(cache_filename, mmap_mode='r')
+
 
 class Plot:
+    """
+    Plots of the benchmark results, saved to ./results.
+    matplotlib is only imported by the first plot, so runs that never plot do not pay for it.
+    """
+    HEADLESS_BACKEND = 'Agg'
+    STRIP_RATIO = 10  # ratio of line height/width, e.g. colour lines will have height 10 and width 1
+    PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    @staticmethod
+    def __get_pyplot():
+        import matplotlib
+        if 'MPLBACKEND' not in os.environ:
+            # The plots are only saved to files, so a non-interactive backend is enough
+            matplotlib.use(Plot.HEADLESS_BACKEND)
+        import matplotlib.pyplot as plt
+        return plt
+
     @staticmethod
-    def __save_plot(figure: Figure, filename: str, subset_size: int = None, iterations: int = None):
+    def render(jobs: List[tuple]):
+        """
+        Draw a batch of plots. The jobs only hold plain data, so they can be rendered in a separate process.
+        :param jobs: a list of (plot method name, arguments) tuples, e.g. ("times", (times, colours, iterations)).
+        """
+        for method_name, arguments in jobs:
+            getattr(Plot, method_name)(*arguments)
+
+    @staticmethod
+    def __get_filename(filename: str, subset_size: int = None, iterations: int = None) -> str:
         filename = f"./results/{filename}"
 
         if subset_size is not None:
@@ -69,14 +401,77 @@ class Plot:
         if iterations is not None:
             filename += f"_{iterations}"
 
-        figure.savefig(filename, bbox_inches='tight')
+        return filename
 
     @staticmethod
-    def colours(colours: list, total_distance: float = None, algorithm_name: str = None, run_time: float = None):
-        ratio = 10  # ratio of line height/width, e.g. colour lines will have height 10 and width 1
-        img = np.zeros((ratio, len(colours), 3))
-        for i in range(len(colours)):
-            img[:, i, :] = colours[i].to_tuple()
+    def __save_plot(figure: 'Figure', filename: str, subset_size: int = None, iterations: int = None):
+        figure.savefig(Plot.__get_filename(filename, subset_size, iterations), bbox_inches='tight')
+        Plot.__get_pyplot().close(figure)
+
+    @staticmethod
+    def __get_values(colours) -> np.ndarray:
+        """Get the N x 3 coordinates of a ColoursList, an array or a list of colours."""
+        if isinstance(colours, np.ndarray):
+            return colours
+        if hasattr(colours, 'values'):
+            return colours.values
+        return np.array([colour.rgb for colour in colours], dtype=np.float64)
+
+    @staticmethod
+    def get_colour_strip(colours, height: int = STRIP_RATIO, width: int = 1) -> np.ndarray:
+        """
+        Get the image of the colours as vertical lines, built in one operation from the coordinates.
+        :param colours: a ColoursList, an N x 3 array or a list of colours.
+        :param height: the height of the image in pixels.
+        :param width: the width of every colour line in pixels.
+        :return: a height x (N * width) x 3 array of floats between 0 and 1.
+        """
+        line = np.repeat(Plot.__get_values(colours), width, axis=0)
+        return np.broadcast_to(line, (height,) + line.shape)
+
+    @staticmethod
+    def __png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + \
+            struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+    @staticmethod
+    def encode_png(image: np.ndarray, compression: int = 6) -> bytes:
+        """
+        Encode an RGB image as a PNG, without going through matplotlib.
+        :param image: a height x width x 3 array of floats between 0 and 1.
+        :param compression: the zlib compression level, from 0 to 9.
+        """
+        height, width, _ = image.shape
+        pixels = np.clip(np.rint(np.asarray(image) * 255), 0, 255).astype(np.uint8)
+
+        # Every scanline starts with its filter type, 0 means no filter
+        scanlines = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+        scanlines[:, 1:] = pixels.reshape(height, width * 3)
+
+        header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)  # 8 bits RGB, no interlacing
+        return Plot.PNG_SIGNATURE + Plot.__png_chunk(b'IHDR', header) + \
+            Plot.__png_chunk(b'IDAT', zlib.compress(scanlines.tobytes(), compression)) + \
+            Plot.__png_chunk(b'IEND', b'')
+
+    @staticmethod
+    def colour_strip(colours, algorithm_name: str = None, height: int = 100, width: int = 2):
+        """
+        Save the colours as a PNG strip with the lightweight encoder, without the text of Plot.colours.
+        :param colours: a ColoursList, an N x 3 array or a list of colours.
+        """
+        filename = Plot.__get_filename(algorithm_name if algorithm_name is not None else "Subset", len(colours))
+        with open(f"{filename}.png", 'wb') as png:
+            png.write(Plot.encode_png(Plot.get_colour_strip(colours, height, width)))
+
+    @staticmethod
+    def colours(colours: list, total_distance: float = None, algorithm_name: str = None, run_time: float = None,
+                metric: str = "euclidean"):
+        """
+        :param colours: a ColoursList, an N x 3 array or a list of colours.
+        :param metric: the name of the metric the total distance is measured with.
+        """
+        plt = Plot.__get_pyplot()
+        img = Plot.get_colour_strip(colours)
 
         fig, axes = plt.subplots(1, figsize=(8, 4))  # figsize=(width,height) handles window dimensions
         axes.imshow(img, interpolation='nearest')
@@ -94,10 +489,10 @@ class Plot:
             plt.text(0, line2_y, f"Algorithm: {algorithm_name}")
 
         formatted_distance = "{0:.2f}".format(total_distance)
-        plt.text(0, line3_y, f"Total distance (euclidean): {formatted_distance}")
+        plt.text(0, line3_y, f"Total distance ({metric}): {formatted_distance}")
 
         if run_time is not None:
-            plt.text(0, line4_y, f"Algorithm running time: {run_time} s")
+            plt.text(0, line4_y, f"Algorithm running time: {run_time:.2f} s")
 
         Plot.__save_plot(
             fig,
@@ -107,6 +502,7 @@ class Plot:
 
     @staticmethod
     def times(times: list, colours: int, iterations: int):
+        plt = Plot.__get_pyplot()
         # Create box with values
         fig = plt.figure(1, figsize=(8, 4))
         ax = fig.add_subplot(111)  # rows, cols, num
@@ -123,10 +519,8 @@ class Plot:
         Plot.__save_plot(fig, "Execution_times", colours, iterations)
 
     @staticmethod
-    def candlestick_distances(algorithm: str, distances: list, colours: int, iterations: int):
-        # Clear prev figure
-        plt.clf()
-
+    def candlestick_distances(algorithm: str, distances: list, colours: int, iterations: int, gap: float = None):
+        plt = Plot.__get_pyplot()
         # Create box with values
         fig = plt.figure(1, figsize=(8, 4))
         ax = fig.add_subplot(111)  # rows, cols, num
@@ -135,7 +529,10 @@ class Plot:
         mean, median, std = Data.get_statistics(distances)
 
         # Create box with values
-        ax_text = '\n'.join((r'Mean=%.2f' % (mean,), r'Median=%.2f' % (median,), r'STD=%.2f' % (std,)))
+        lines = [r'Mean=%.2f' % (mean,), r'Median=%.2f' % (median,), r'STD=%.2f' % (std,)]
+        if gap is not None:
+            lines.append(r'Gap=%.2f%%' % (100 * gap,))
+        ax_text = '\n'.join(lines)
         props = dict(boxstyle='square', facecolor='grey', alpha=0.5)
         ax.text(0.05, 0.95, ax_text, transform=ax.transAxes, fontsize=14, verticalalignment='top', bbox=props)
 
@@ -151,9 +548,7 @@ class Plot:
 
     @staticmethod
     def scatter_distances(algorithm: str, distances: list, colours: int, iterations: int):
-        # Clear prev figure
-        plt.clf()
-
+        plt = Plot.__get_pyplot()
         fig = plt.figure()
         plt.plot(distances)
         plt.title(f"{algorithm}: {iterations} iterations with {colours} colours")
@@ -167,9 +562,7 @@ class Plot:
         """
         Create a barchart for the algorithms running times.
         """
-        # Clear prev figure
-        plt.clf()
-
+        plt = Plot.__get_pyplot()
         fig, ax = plt.subplots(figsize=(9, 6))
         x_pos = np.arange(len(algorithms))
         ax.bar(x_pos, times, align='center', alpha=0.5, ecolor='red', capsize=10)
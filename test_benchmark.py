@@ -0,0 +1,23 @@
+import numpy as np
+
+from Algorithms import AlgorithmType
+from ResultStore import ResultStore
+import TestRunner
+
+
+def run_stored_sweep(filename: str, iterations: int) -> list:
+    colours = np.random.default_rng(0).random((200, 3))
+    runner = TestRunner.TestRunner(colours, store=ResultStore(filename), seed=1)
+    runner.add_run_configuration(AlgorithmType.HILL_CLIMBING, 100, iterations)
+    runner.add_run_configuration(AlgorithmType.MULTI_START_HC, 100, iterations)
+    runner.configure()
+    runner.run()
+    return [benchmark.get_distances() for benchmark in runner.benchmarks]
+
+
+def test_resumed_stored_sweep_matches_uninterrupted_sweep(tmp_path):
+    uninterrupted = run_stored_sweep(str(tmp_path / "uninterrupted.db"), 5)
+    run_stored_sweep(str(tmp_path / "resumed.db"), 2)
+    resumed = run_stored_sweep(str(tmp_path / "resumed.db"), 5)
+    assert resumed == uninterrupted
+
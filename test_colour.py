@@ -0,0 +1,23 @@
+import numpy as np
+
+from Colour import ColoursList, Metric
+
+
+def get_colours() -> ColoursList:
+    return ColoursList(np.random.default_rng(0).random((7, 3)), metric=Metric.CIE76)
+
+
+def test_getitem_slice_honours_step():
+    colours = get_colours()
+    assert np.array_equal(colours[::-1].values, colours.values[::-1])
+    assert np.array_equal(colours[::2].values, colours.values[::2])
+    assert np.array_equal(colours[1:5].values, colours.values[1:5])
+    assert np.array_equal(colours[::-1].lab, colours.lab[::-1])
+    assert colours[::-1].metric == Metric.CIE76
+
+
+def test_getitem_slice_copies():
+    colours = get_colours()
+    reversed_colours = colours[::-1]
+    reversed_colours.values[0] = 0
+    assert not np.array_equal(colours.values[-1], reversed_colours.values[0])